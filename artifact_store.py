@@ -0,0 +1,174 @@
+"""Resolves the SDXL model and LoRA files from one directory and checks them before they are loaded.
+
+    python artifact_store.py check      # validate every LoRA file
+    python artifact_store.py convert    # save a local fp16 safetensors copy of the model
+"""
+import argparse
+import json
+import math
+import os
+import struct
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Tuple
+
+# Holds Stable_Diffusion_lora/ with the LoRA files and models/ with converted pipelines
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "..")
+LORA_DIR = "Stable_Diffusion_lora"
+MODEL_DIR = "models"
+SDXL_MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+
+LORA_FILES = {
+    "lego": "Lego.safetensors",
+    "oil": "Oil.safetensors",
+    "manga": "Manga.safetensors",
+    "anime": "animescreencap_xl.safetensors",
+    "sketch": "Sketch.safetensors",
+}
+
+# Bytes per element of each safetensors dtype
+SAFETENSORS_DTYPES = {
+    "BOOL": 1, "U8": 1, "I8": 1, "F8_E4M3": 1, "F8_E5M2": 1,
+    "I16": 2, "U16": 2, "F16": 2, "BF16": 2,
+    "I32": 4, "U32": 4, "F32": 4,
+    "I64": 8, "U64": 8, "F64": 8,
+}
+# Real headers are a few hundred kilobytes; a larger length prefix means the file is not safetensors
+MAX_HEADER_BYTES = 100 * 1024 * 1024
+
+
+class InvalidArtifactError(Exception):
+    """Raised when an artifact is missing or is not a well-formed safetensors file."""
+
+
+@dataclass
+class LoraArtifact:
+    style: str
+    path: str
+    size: int
+    tensors: int
+
+
+def read_safetensors_header(path: str) -> Dict[str, Any]:
+    """Reads and checks the header of a safetensors file without reading any tensor data.
+
+    Every tensor must have a known dtype and lie inside the file with exactly
+    the size its shape implies, which catches truncated downloads and files
+    that are not safetensors at all.
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            prefix = f.read(8)
+            if len(prefix) < 8:
+                raise InvalidArtifactError(f"{path} is too short to be a safetensors file.")
+            (header_size,) = struct.unpack("<Q", prefix)
+            if header_size > min(MAX_HEADER_BYTES, size - 8):
+                raise InvalidArtifactError(f"{path} has a header length of {header_size} bytes that does not fit the file.")
+            header = json.loads(f.read(header_size))
+    except FileNotFoundError:
+        raise InvalidArtifactError(f"{path} does not exist.")
+    except (OSError, ValueError) as e:
+        raise InvalidArtifactError(f"{path} has an unreadable header: {e}")
+
+    if not isinstance(header, dict):
+        raise InvalidArtifactError(f"{path} has a header that is not a JSON object.")
+    data_size = size - 8 - header_size
+    for name, entry in header.items():
+        if name == "__metadata__":
+            continue
+        try:
+            begin, end = entry["data_offsets"]
+            expected = SAFETENSORS_DTYPES[entry["dtype"]] * math.prod(int(dim) for dim in entry["shape"])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidArtifactError(f"{path} has a malformed entry for tensor '{name}'.")
+        if not 0 <= begin <= end <= data_size or end - begin != expected:
+            raise InvalidArtifactError(f"{path} is truncated or corrupt: tensor '{name}' does not fit the file.")
+    return header
+
+
+class ArtifactStore:
+    """Resolves every model and LoRA path under one root and validates LoRA files up front.
+
+    Weights are loaded by diffusers from safetensors, which memory-maps them,
+    so workers on one host read the same page cache. A model converted into
+    `<root>/models` is already fp16 safetensors and loads without a hub
+    lookup or a dtype conversion pass.
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR):
+        self.root = os.path.abspath(root)
+        self.loras: Dict[str, LoraArtifact] = {}
+        # Style -> why its LoRA file was rejected
+        self.invalid: Dict[str, str] = {}
+
+    def lora_path(self, filename: str) -> str:
+        return os.path.join(self.root, LORA_DIR, filename)
+
+    def model_path(self, model_id: str) -> str:
+        return os.path.join(self.root, MODEL_DIR, model_id.replace("/", "--"))
+
+    def resolve_model(self, model_id: str) -> Tuple[str, bool]:
+        """Returns the converted local copy of a model if there is one, otherwise the hub id, and whether it is local."""
+        path = self.model_path(model_id)
+        if os.path.exists(os.path.join(path, "model_index.json")):
+            return path, True
+        return model_id, False
+
+    def validate_loras(self, files: Dict[str, str] = LORA_FILES) -> Dict[str, LoraArtifact]:
+        """Checks every LoRA file and returns the usable ones by style; the rest are listed in `invalid`."""
+        for style, filename in files.items():
+            path = self.lora_path(filename)
+            try:
+                header = read_safetensors_header(path)
+                tensors = [name for name in header if name != "__metadata__"]
+                if not any("lora" in name.lower() for name in tensors):
+                    raise InvalidArtifactError(f"{path} contains no LoRA weights.")
+            except InvalidArtifactError as e:
+                self.invalid[style] = str(e)
+                continue
+            self.loras[style] = LoraArtifact(style, path, os.path.getsize(path), len(tensors))
+        return self.loras
+
+    def stats(self) -> Dict[str, Any]:
+        model_path, local = self.resolve_model(SDXL_MODEL_ID)
+        return {
+            "root": self.root,
+            "model": {"path": model_path, "local": local},
+            "loras": {style: asdict(artifact) for style, artifact in self.loras.items()},
+            "invalid": dict(self.invalid),
+        }
+
+
+def convert_model(store: ArtifactStore, model_id: str = SDXL_MODEL_ID) -> str:
+    """Saves an fp16 safetensors copy of a hub model into the store and returns its path."""
+    import torch
+    from diffusers import StableDiffusionXLPipeline
+
+    pipe = StableDiffusionXLPipeline.from_pretrained(model_id, torch_dtype=torch.float16, use_safetensors=True)
+    path = store.model_path(model_id)
+    pipe.save_pretrained(path, safe_serialization=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["check", "convert"])
+    parser.add_argument("--root", default=ARTIFACT_DIR)
+    parser.add_argument("--model", default=SDXL_MODEL_ID)
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.root)
+    if args.command == "convert":
+        print(f"Saved {args.model} to {convert_model(store, args.model)}")
+        return
+
+    for style, artifact in store.validate_loras().items():
+        print(f"ok       {style:<8}{artifact.tensors:>6} tensors  {artifact.path}")
+    for style, problem in store.invalid.items():
+        print(f"invalid  {style:<8}{problem}")
+    if store.invalid:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+LLM_FLOW_WORKERS = int(os.environ.get("LLM_FLOW_WORKERS", "4"))
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", "2"))
+# LLM calls a running flow fans out to, such as section rewrites
+LLM_CALL_WORKERS = int(os.environ.get("LLM_CALL_WORKERS", "8"))
+# Speculative scene extractions; kept off the llm pool so they never delay user requests
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "1"))
+
+
+class InstrumentedPool(Executor):
+    """A thread pool that records how long tasks wait for a worker versus how long they run.
+
+    `max_workers` is also the concurrency limit: further submissions queue
+    until a worker frees up. Tasks run in a copy of the submitter's context,
+    so trace spans they open belong to the submitting request.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._wait_seconds = 0.0
+        self._run_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        submitted_at = time.monotonic()
+        with self._lock:
+            self._queued += 1
+
+        def timed():
+            started_at = time.monotonic()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                finished_at = time.monotonic()
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._wait_seconds += started_at - submitted_at
+                    self._max_wait_seconds = max(self._max_wait_seconds, started_at - submitted_at)
+                    self._run_seconds += finished_at - started_at
+
+        # Carry the caller's trace context onto the worker thread
+        return self._executor.submit(contextvars.copy_context().run, timed)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Runs `fn` on the pool and awaits its result."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "wait_seconds_total": self._wait_seconds,
+                "run_seconds_total": self._run_seconds,
+                "wait_seconds_avg": self._wait_seconds / completed,
+                "run_seconds_avg": self._run_seconds / completed,
+                "wait_seconds_max": self._max_wait_seconds,
+            }
+
+
+class ExecutionLayer:
+    """Application-scoped pools: `llm` runs CrewAI flows, `cpu` runs image post-processing.
+
+    `llm_calls` runs the parallel LLM calls of work already running on `llm`;
+    submitting those to `llm` itself could deadlock once every flow waits on
+    its own sub-calls. `prefetch` runs speculative work that no request is
+    waiting for yet.
+    """
+
+    def __init__(
+        self,
+        llm_workers: int = LLM_FLOW_WORKERS,
+        cpu_workers: int = POSTPROCESS_WORKERS,
+        llm_call_workers: int = LLM_CALL_WORKERS,
+        prefetch_workers: int = PREFETCH_WORKERS,
+    ):
+        self.llm = InstrumentedPool("llm-flow", llm_workers)
+        self.cpu = InstrumentedPool("postprocess", cpu_workers)
+        self.llm_calls = InstrumentedPool("llm-call", llm_call_workers)
+        self.prefetch = InstrumentedPool("scene-prefetch", prefetch_workers)
+
+    def pools(self) -> Dict[str, InstrumentedPool]:
+        return {"llm": self.llm, "cpu": self.cpu, "llm_calls": self.llm_calls, "prefetch": self.prefetch}
+
+    def shutdown(self):
+        # Queued work is dropped; flows and encodes already running are allowed to finish
+        for pool in self.pools().values():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self.pools().items()}
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+IMAGE_CACHE_MEMORY_ITEMS = int(os.environ.get("IMAGE_CACHE_MEMORY_ITEMS", "64"))
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", ".image_cache")
+IMAGE_CACHE_DISK_MB = float(os.environ.get("IMAGE_CACHE_DISK_MB", "1024"))
+
+
+def image_cache_key(prompt: str, style: str, seed: Optional[int], params: Dict[str, Any]) -> str:
+    """Hashes everything that determines a rendered image."""
+    material = json.dumps({"prompt": prompt, "style": style, "seed": seed, "params": params}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """Two-tier cache of rendered images: an in-memory LRU in front of a size-bounded PNG directory.
+
+    The disk tier evicts least recently used files (by mtime) once it grows past
+    `disk_max_bytes`. Set `directory` to an empty string to disable it. Disk
+    writes are handed to `executor` when one is given so callers do not wait
+    for PNG encoding.
+    """
+
+    def __init__(
+        self,
+        memory_items: int = IMAGE_CACHE_MEMORY_ITEMS,
+        directory: str = IMAGE_CACHE_DIR,
+        disk_max_bytes: int = int(IMAGE_CACHE_DISK_MB * 1024 * 1024),
+        executor: Optional[Executor] = None,
+    ):
+        self.memory_items = memory_items
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.executor = executor
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return image
+
+        image = self._read_disk(key)
+        with self._lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, image)
+        return image
+
+    def put(self, key: str, image: Image.Image):
+        with self._lock:
+            self._remember(key, image)
+        if self.executor:
+            self.executor.submit(self._write_disk, key, image)
+        else:
+            self._write_disk(key, image)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _remember(self, key: str, image: Image.Image):
+        self._memory[key] = image
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Image.Image]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with Image.open(path) as image:
+                image.load()
+            # Touch the file so eviction treats it as recently used
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            return None
+        return image
+
+    def _write_disk(self, key: str, image: Image.Image):
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        image.save(tmp_path, format="PNG")
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_bytes += size
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith(".png")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self._disk_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self._disk_bytes -= size
@@ -0,0 +1,156 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image
+
+IMAGE_STORE_MB = float(os.environ.get("IMAGE_STORE_MB", "256"))
+IMAGE_STORE_TTL = float(os.environ.get("IMAGE_STORE_TTL", "3600"))
+# Keep images as files in this directory, so every API worker on the host can serve them
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", "")
+
+# Response format -> (PIL format name, media type)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+
+def encode_image(image: Image.Image, image_format: str = "png", quality: int = 90) -> Tuple[bytes, str]:
+    """Encodes an image, returning the bytes and their media type. `quality` is ignored for PNG."""
+    pil_format, media_type = IMAGE_FORMATS[image_format]
+    options = {} if pil_format == "PNG" else {"quality": quality}
+    if pil_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffered = io.BytesIO()
+    image.save(buffered, format=pil_format, **options)
+    return buffered.getvalue(), media_type
+
+
+class ImageStore:
+    """Holds encoded images for download by id, bounded by total size and age."""
+
+    def __init__(self, max_bytes: int = int(IMAGE_STORE_MB * 1024 * 1024), ttl: float = IMAGE_STORE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._images: "OrderedDict[str, Tuple[bytes, str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes, media_type: str, image_id: Optional[str] = None) -> str:
+        """Stores encoded bytes under `image_id` (a random id if omitted) and returns the id."""
+        image_id = image_id or uuid.uuid4().hex
+        with self._lock:
+            if image_id in self._images:
+                self._drop(image_id)
+            self._images[image_id] = (data, media_type, time.monotonic() + self.ttl)
+            self._bytes += len(data)
+            self._evict()
+        return image_id
+
+    def get(self, image_id: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._images.get(image_id)
+            if entry is None:
+                return None
+            data, media_type, expires = entry
+            if time.monotonic() > expires:
+                self._drop(image_id)
+                return None
+            return data, media_type
+
+    def _evict(self):
+        now = time.monotonic()
+        for image_id in [image_id for image_id, (_, _, expires) in self._images.items() if now > expires]:
+            self._drop(image_id)
+        while self._bytes > self.max_bytes and self._images:
+            self._drop(next(iter(self._images)))
+
+    def _drop(self, image_id: str):
+        data, _, _ = self._images.pop(image_id)
+        self._bytes -= len(data)
+
+
+class FileImageStore:
+    """Holds encoded images as files in a directory shared by the API workers, bounded by total size and age.
+
+    Files are named after the image id and the format's extension; age is
+    taken from the file's modification time, so every worker agrees on it.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = int(IMAGE_STORE_MB * 1024 * 1024), ttl: float = IMAGE_STORE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._extensions = {media_type: extension for extension, (_, media_type) in IMAGE_FORMATS.items()}
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, data: bytes, media_type: str, image_id: Optional[str] = None) -> str:
+        """Stores encoded bytes under `image_id` (a random id if omitted) and returns the id."""
+        image_id = image_id or uuid.uuid4().hex
+        path = os.path.join(self.directory, f"{image_id}.{self._extensions[media_type]}")
+        # Write then rename so other workers never serve a partially written file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+        return image_id
+
+    def get(self, image_id: str) -> Optional[Tuple[bytes, str]]:
+        if not image_id.isalnum():
+            return None
+        for extension, (_, media_type) in IMAGE_FORMATS.items():
+            path = os.path.join(self.directory, f"{image_id}.{extension}")
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl:
+                    self._remove(path)
+                    return None
+                with open(path, "rb") as f:
+                    return f.read(), media_type
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _evict(self):
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path: str):
+        # Another worker may have evicted it first
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def create_image_store(shared: bool = False):
+    """Uses a file-backed store when IMAGE_STORE_DIR is set or `shared` asks for one, otherwise keeps images in memory."""
+    directory = IMAGE_STORE_DIR or (os.path.join(tempfile.gettempdir(), "story-generator-images") if shared else "")
+    if directory:
+        return FileImageStore(directory)
+    return ImageStore()
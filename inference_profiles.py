@@ -0,0 +1,106 @@
+import json
+import os
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, Optional
+
+from story_creator_flow.instrumentation import stage
+
+
+@dataclass(frozen=True)
+class InferenceProfile:
+    """Pipeline settings that trade image quality for render time."""
+
+    name: str
+    scheduler: str
+    steps: int
+    width: int
+    height: int
+    guidance_scale: float
+    attention_slicing: bool = False
+    vae_tiling: bool = False
+
+    def pipeline_kwargs(self) -> Dict[str, Any]:
+        return {
+            "num_inference_steps": self.steps,
+            "width": self.width,
+            "height": self.height,
+            "guidance_scale": self.guidance_scale,
+        }
+
+    def image_to_image_kwargs(self, strength: float) -> Dict[str, Any]:
+        # img2img takes its size from the input image and runs `steps * strength` denoising steps
+        return {"num_inference_steps": self.steps, "guidance_scale": self.guidance_scale, "strength": strength}
+
+    def settings(self) -> Dict[str, Any]:
+        """Everything that affects the image, for cache keys; profiles with equal settings share cached images."""
+        settings = asdict(self)
+        del settings["name"]
+        return settings
+
+
+# "final" matches the SDXL base defaults the app rendered with before profiles existed
+DEFAULT_PROFILES = {
+    # Low-resolution previews that are later upscaled from the same prompt and seed
+    "preview": InferenceProfile("preview", "DPMSolverMultistepScheduler", steps=10, width=512, height=512, guidance_scale=5.0),
+    "draft": InferenceProfile("draft", "DPMSolverMultistepScheduler", steps=12, width=768, height=768, guidance_scale=5.0),
+    "standard": InferenceProfile("standard", "DPMSolverMultistepScheduler", steps=25, width=1024, height=1024, guidance_scale=5.0),
+    "final": InferenceProfile("final", "EulerDiscreteScheduler", steps=50, width=1024, height=1024, guidance_scale=5.0),
+}
+
+
+def load_profiles(overrides: str) -> Dict[str, InferenceProfile]:
+    """Applies a JSON object of per-profile field overrides, e.g. '{"draft": {"steps": 8}}', to the defaults.
+
+    Names that are not built in define new profiles and must give every field.
+    """
+    profiles = dict(DEFAULT_PROFILES)
+    for name, fields in json.loads(overrides or "{}").items():
+        if name in profiles:
+            profiles[name] = replace(profiles[name], **fields)
+        else:
+            profiles[name] = InferenceProfile(name=name, **fields)
+    return profiles
+
+
+INFERENCE_PROFILES = load_profiles(os.environ.get("INFERENCE_PROFILES", ""))
+DEFAULT_INFERENCE_PROFILE = os.environ.get("DEFAULT_INFERENCE_PROFILE", "final")
+
+
+class ProfileSwitcher:
+    """Puts the pipeline's scheduler, attention slicing and VAE tiling in the state a profile asks for.
+
+    Must be called while holding the pipeline, like an adapter switch. Nothing
+    is touched when the profile is already active, and each scheduler is built
+    once from the pipeline's original scheduler config.
+    """
+
+    def __init__(self, pipe, profiles: Optional[Dict[str, InferenceProfile]] = None):
+        self.pipe = pipe
+        self.active: Optional[str] = None
+        self._base_config = getattr(pipe.scheduler, "config", {})
+        self._schedulers = {type(pipe.scheduler).__name__: pipe.scheduler}
+        self._compatible = {cls.__name__: cls for cls in getattr(pipe.scheduler, "compatibles", [])}
+        # Stand-in pipelines have no scheduler variants; real ones must support every configured scheduler
+        if self._compatible:
+            for profile in (profiles or INFERENCE_PROFILES).values():
+                if profile.scheduler not in self._schedulers and profile.scheduler not in self._compatible:
+                    raise ValueError(f"Profile '{profile.name}' uses {profile.scheduler}, which this pipeline does not support.")
+
+    def apply(self, profile: InferenceProfile):
+        if profile.name == self.active:
+            return
+        with stage("profile_switch", profile=profile.name):
+            scheduler = self._scheduler(profile.scheduler)
+            if scheduler is not None:
+                self.pipe.scheduler = scheduler
+            self._toggle("attention_slicing", profile.attention_slicing)
+            self._toggle("vae_tiling", profile.vae_tiling)
+        self.active = profile.name
+
+    def _scheduler(self, name: str):
+        if name not in self._schedulers and name in self._compatible:
+            self._schedulers[name] = self._compatible[name].from_config(self._base_config)
+        return self._schedulers.get(name)
+
+    def _toggle(self, option: str, enabled: bool):
+        getattr(self.pipe, f"{'enable' if enabled else 'disable'}_{option}")()
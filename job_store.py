@@ -0,0 +1,147 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+JOB_TTL = float(os.environ.get("JOB_TTL", "3600"))
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str = "queued"  # queued, running, succeeded, failed
+    created_at: float
+    updated_at: float
+    result: Any = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+
+class JobStore(ABC):
+    """Keeps job records; finished jobs are evicted `ttl` seconds after their last update."""
+
+    def __init__(self, ttl: float = JOB_TTL):
+        self.ttl = ttl
+
+    def create(self, kind: str) -> Job:
+        now = time.time()
+        job = Job(id=uuid.uuid4().hex, kind=kind, created_at=now, updated_at=now)
+        self.evict_expired()
+        self.save(job)
+        return job
+
+    def update(self, job_id: str, **fields) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job = job.model_copy(update={**fields, "updated_at": time.time()})
+        self.save(job)
+        return job
+
+    def is_expired(self, job: Job) -> bool:
+        return job.finished and time.time() - job.updated_at > self.ttl
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def save(self, job: Job):
+        ...
+
+    @abstractmethod
+    def evict_expired(self):
+        ...
+
+
+class InMemoryJobStore(JobStore):
+    """Process-local job store."""
+
+    def __init__(self, ttl: float = JOB_TTL):
+        super().__init__(ttl)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and self.is_expired(job):
+                del self._jobs[job_id]
+                return None
+            return job
+
+    def save(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def evict_expired(self):
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if self.is_expired(job)]:
+                del self._jobs[job_id]
+
+
+class FileJobStore(JobStore):
+    """Stores one JSON file per job in a directory, standing in for a store shared between workers."""
+
+    def __init__(self, directory: str, ttl: float = JOB_TTL):
+        super().__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                job = Job.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+        if self.is_expired(job):
+            self._remove(job_id)
+            return None
+        return job
+
+    def save(self, job: Job):
+        # Write then rename so readers never see a partially written file
+        tmp_path = self._path(job.id) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(job.model_dump_json())
+        os.replace(tmp_path, self._path(job.id))
+
+    def evict_expired(self):
+        # Judged by modification time so no job file is parsed: a job not updated
+        # for `ttl` seconds has finished that long ago, or its worker is gone
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    self._remove(entry.name[:-len(".json")])
+            except FileNotFoundError:
+                pass
+
+    def _remove(self, job_id: str):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+def create_job_store(shared: bool = False) -> JobStore:
+    """Uses a file-backed store when JOB_STORE_DIR is set or `shared` asks for one, otherwise keeps jobs in memory."""
+    directory = os.environ.get("JOB_STORE_DIR") or (os.path.join(tempfile.gettempdir(), "story-generator-jobs") if shared else "")
+    if directory:
+        return FileJobStore(directory)
+    return InMemoryJobStore()
@@ -0,0 +1,146 @@
+"""Drives the story API at a fixed concurrency and reports latency percentiles and throughput.
+
+Start the server with the offline backends to measure the app itself rather than the models:
+
+    STORY_LLM_BACKEND=fake DIFFUSION_BACKEND=stub uvicorn main:app
+    python load_test.py --scenario full --concurrency 8 --requests 200
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Any, Dict, List
+
+SAMPLE_STORY = {
+    "introduction_setting": "A curious fox lives at the edge of a quiet forest.",
+    "conflict_rising_action": "One morning a lost robot wanders into the fox's den.",
+    "climax": "A storm rolls in and the two must find shelter together.",
+    "resolution": "The storm passes and the fox guides the robot home.",
+}
+
+
+def post(base_url: str, path: str, body: Dict[str, Any], timeout: float) -> Any:
+    request = urllib.request.Request(
+        base_url.rstrip("/") + path,
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def sample_story(index: int) -> Dict[str, str]:
+    """Returns SAMPLE_STORY made unique to this run, so its scenes and images are not cached."""
+    return {section: f"{text} ({index})" for section, text in SAMPLE_STORY.items()}
+
+
+def run_scenario(args, index: int, record) -> None:
+    # With --cached every run sends the same request, so runs after the first hit the crew and image caches
+    prompt = "A fox and a robot become friends" if args.cached else f"A fox and a robot become friends ({index})"
+
+    def timed(stage: str, path: str, body: Dict[str, Any]) -> Any:
+        started_at = time.perf_counter()
+        try:
+            result = post(args.url, path, body, args.timeout)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            record(stage, time.perf_counter() - started_at, e)
+            raise
+        record(stage, time.perf_counter() - started_at, None)
+        return result
+
+    story = SAMPLE_STORY if args.cached else sample_story(index)
+    if args.scenario in ("generate", "full"):
+        story = timed("generate", "/api/stories/generate", {
+            "prompt": prompt,
+            "genre": "adventure",
+            "tone": "light",
+            "artStyle": args.art_style,
+        })
+    if args.scenario in ("scenes", "full"):
+        timed("get_scenes", "/api/stories/get_scenes", {
+            "story": story,
+            "artStyle": args.art_style,
+            "responseMode": args.response_mode,
+            "profile": args.profile,
+        })
+    if args.scenario == "refine":
+        timed("refine", "/api/stories/refine", {"prompt": "Make it funnier", "story": story})
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenario", choices=["generate", "scenes", "refine", "full"], default="full")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40, help="Scenario runs in total; ignored with --duration")
+    parser.add_argument("--duration", type=float, default=None, help="Run for this many seconds instead")
+    parser.add_argument("--art-style", default="lego")
+    parser.add_argument("--response-mode", choices=["base64", "url"], default="url")
+    parser.add_argument("--profile", default="final", help="Inference profile for get_scenes, e.g. draft or final")
+    parser.add_argument("--cached", action="store_true", help="Send the same story every run to measure cache hits")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    counter = iter(range(1 << 62))
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def record(stage: str, seconds: float, error: Exception) -> None:
+        with lock:
+            if error is None:
+                latencies[stage].append(seconds)
+            else:
+                errors[stage] += 1
+                print(f"{stage} failed: {error}")
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter)
+            if deadline is None and index >= args.requests:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            try:
+                run_scenario(args, index, record)
+            except Exception:
+                pass
+
+    started_at = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    print(f"\n{args.scenario} scenario, concurrency {args.concurrency}, {elapsed:.1f}s")
+    if args.cached:
+        print("Every run sent the same story: runs after the first were served from the crew and image caches.")
+    else:
+        print("Every run sent a different story: crew and image caches missed.")
+    print(f"{'stage':<12}{'ok':>6}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'mean':>9}{'req/s':>9}")
+    for stage in sorted(set(latencies) | set(errors)):
+        values = latencies[stage]
+        if values:
+            row = [percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99), statistics.mean(values)]
+            timings = "".join(f"{value:>8.2f}s" for value in row)
+        else:
+            timings = "".join(f"{'-':>9}" for _ in range(4))
+        print(f"{stage:<12}{len(values):>6}{errors[stage]:>8}{timings}{len(values) / elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
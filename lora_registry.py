@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from story_creator_flow.instrumentation import stage
+
+
+class LoraRegistry:
+    """Keeps every art style resident on the pipeline as a named LoRA adapter.
+
+    Adapters are loaded once at startup and switched by activating them, so a
+    request never reads a safetensors file. The render worker is the only
+    caller of `use` and runs one job at a time; it also decides the job order
+    that keeps adapter switches to a minimum.
+    """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.adapters: Dict[str, str] = {}
+        self.active_style: Optional[str] = None
+
+    def __contains__(self, style: str) -> bool:
+        return style in self.adapters
+
+    def register(self, style: str, path: str):
+        """Loads the LoRA weights at `path` as an adapter named after the style."""
+        self.pipe.load_lora_weights(path, adapter_name=style)
+        self.adapters[style] = path
+
+    @contextmanager
+    def use(self, style: str):
+        """Yields the pipeline with the adapter for `style` active."""
+        if style not in self.adapters:
+            raise KeyError(style)
+        self._activate(style)
+        yield self.pipe
+
+    def _activate(self, style: str):
+        if style == self.active_style:
+            return
+        with stage("lora_activation", style=style):
+            self.pipe.set_adapters([style])
+        self.active_style = style
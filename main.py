@@ -1,55 +1,122 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 import sys
 import os
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 sys.path.append(os.path.join(os.path.dirname(__file__), 'story-generator', 'story_creator_flow', 'src'))
+STARTED_AT = time.perf_counter()
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, Any
-import torch
-from diffusers import StableDiffusionXLPipeline
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Awaitable, Callable, Dict, Any, List, Literal, Optional, Tuple, Union
 from PIL import Image
 import io
-import base64
-from story_creator_flow.main import StoryFlow, ScenesFlow
+import json
+import re
+import uuid
+from story_creator_flow.crew_cache import crew_cache
+from story_creator_flow.instrumentation import JsonLinesExporter, add_observer, annotate, current_trace_id, new_trace_id, stage, trace
+from rendering import STREAM_BATCH_SIZE, UPSCALE_STRENGTH, match_previous_scenes, scene_seeds
+from render_worker import RenderWorker, QueueFullError, WorkerUnavailableError
+from job_store import Job, create_job_store
+from image_cache import ImageCache
+from image_store import IMAGE_FORMATS, create_image_store
+from postprocess import EncodedImage, postprocess_image
+from executors import ExecutionLayer
+from scene_prefetch import ScenePrefetcher
+from artifact_store import ArtifactStore
+from model_server import RemoteRenderWorker, artifact_report, load_render_worker
+from inference_profiles import DEFAULT_INFERENCE_PROFILE, INFERENCE_PROFILES
+import metrics
 import os
-from crewai import llm
-
-# Define LoRA paths
-LORA_PATHS = {
-    "lego": "../Stable_Diffusion_lora/Lego.safetensors",
-    "oil": "../Stable_Diffusion_lora/Oil.safetensors",
-    "manga": "../Stable_Diffusion_lora/Manga.safetensors",
-    "anime": "../Stable_Diffusion_lora/animescreencap_xl.safetensors",
-    "sketch": "../Stable_Diffusion_lora/Sketch.safetensors",
-}
+# Modules importing torch, diffusers or crewAI are imported by the warm-up thread so the server binds right away
+from story_creator_flow.models import Scenes, StoryDetails
+from story_creator_flow.streaming import subscribe, unsubscribed
+from story_creator_flow.refine import SECTIONS, refine_sections
+
+# "remote" sends renders to model_server.py instead of loading the pipeline in this worker
+RENDER_MODE = os.environ.get("RENDER_MODE", "local")
+REFINE_MODEL = os.environ.get("REFINE_MODEL", "gemini/gemini-2.0-flash-lite")
+# Append every finished span to this JSON-lines file; empty disables the exporter
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", "")
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
 
 app = FastAPI(title="CrewAI Story Generator API")
 
-# Initialize the pipeline once per worker
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+# Remote mode runs several API workers; a job or image URL may be fetched from any of them
+job_store = create_job_store(shared=RENDER_MODE == "remote")
+image_store = create_image_store(shared=RENDER_MODE == "remote")
+artifact_store = ArtifactStore()
+background_jobs = set()
+# Set by the warm-up thread once the pipeline is loaded and the render worker runs
+models_ready = threading.Event()
+warmup_error: Optional[str] = None
+cold_start_seconds: Optional[float] = None
+render_worker: Optional[Union[RenderWorker, RemoteRenderWorker]] = None
+add_observer(metrics.observe_span)
+metrics.track_process_memory()
+if TRACE_LOG_PATH:
+    add_observer(JsonLinesExporter(TRACE_LOG_PATH))
+
+def warm_up():
+    """Loads the flows and the pipeline, or connects to the model server, then marks the app ready."""
+    global render_worker
+    global warmup_error
+    global cold_start_seconds
+
+    started_at = time.perf_counter()
+    try:
+        with stage("warmup_imports"):
+            # Pulls in crewAI and registers its stream event handlers before the first request needs them
+            import story_creator_flow.main
+            import story_creator_flow.llm_backend
+
+        if RENDER_MODE == "remote":
+            worker = RemoteRenderWorker()
+            worker.wait_until_available()
+        else:
+            worker = load_render_worker(artifact_store, ImageCache(executor=execution.cpu))
+        metrics.track_render_worker(worker)
+    except Exception as e:
+        warmup_error = str(e)
+        print(f"Warm-up failed: {e}")
+        return
+
+    render_worker = worker
+    cold_start_seconds = time.perf_counter() - STARTED_AT
+    metrics.COLD_START_SECONDS.set(cold_start_seconds)
+    models_ready.set()
+    print(f"Warm-up finished in {time.perf_counter() - started_at:.1f}s. Ready to serve requests.")
+
+
 @app.on_event("startup")
 def startup_event():
-    global pipe
-    global lora_adapters
-
-    print("Loading SDXL pipeline and LoRA weights...")
-
-    model_id = "stabilityai/stable-diffusion-xl-base-1.0"
-    pipe = StableDiffusionXLPipeline.from_pretrained(
-        model_id,
-        torch_dtype=torch.float16,
-        use_safetensors=True
-    ).to("cuda" if torch.cuda.is_available() else "cpu")
-
-    lora_adapters = {}
-    for style, path in LORA_PATHS.items():
-        if os.path.exists(path):
-            lora_adapters[style] = path
-        else:
-            print(f"Warning: LoRA file not found at {path}. Skipping '{style}' style.")
+    global execution
+    global scene_prefetcher
+
+    execution = ExecutionLayer()
+    metrics.track_pools(execution)
+    # Parallel crews inside a flow (the genre and tone guides) are LLM calls fanned out from the llm pool
+    crew_cache.executor = execution.llm_calls
+    scene_prefetcher = ScenePrefetcher(execution.prefetch, run_scenes_flow, max_pending=execution.prefetch.max_workers)
+    # Loading the models takes minutes; serve /healthz and /readyz meanwhile
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
 
-    print("Startup complete. Ready to serve requests.")
+@app.on_event("shutdown")
+def shutdown_event():
+    if render_worker is not None:
+        render_worker.stop()
+    execution.shutdown()
 
 
 app.add_middleware(
@@ -60,104 +127,669 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """Opens the request's root span; every span started while handling it shares its trace id.
+
+    A valid incoming X-Request-ID is reused as the trace id, and the id is
+    returned in the X-Request-ID response header either way.
+    """
+    request_id = request.headers.get("X-Request-ID", "")
+    trace_id = request_id if REQUEST_ID_PATTERN.match(request_id) else new_trace_id()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    try:
+        with trace(trace_id), stage("request", method=request.method, path=request.url.path) as span:
+            span.attributes["status"] = 500
+            response = await call_next(request)
+            span.attributes["status"] = response.status_code
+            # Label by route template so ids in paths do not explode the series count
+            route = request.scope.get("route")
+            span.attributes["route"] = route.path if route else "unmatched"
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+    response.headers["X-Request-ID"] = trace_id
+    return response
+
 class GenerateStoryPayload(BaseModel):
     prompt: str
     genre: str
     tone: str
+    # Start scene extraction (and activate the LoRA for artStyle) while the user reviews the story
+    prefetchScenes: bool = True
+    artStyle: Optional[str] = None
 
 class RefineStoryPayload(BaseModel):
     prompt: str
     story: Dict[str, Any]
+    # "sections" rewrites only the story sections the prompt touches and returns a patch
+    mode: Literal["full", "sections"] = "full"
+    # Sections to rewrite in "sections" mode; detected from the prompt when omitted
+    sections: Optional[List[str]] = None
+
+class ImageOptions(BaseModel):
+    # "base64" embeds images in the JSON, "url" returns /api/images/{id} links,
+    # "multipart" sends the JSON and raw image bytes as parts of one response
+    responseMode: Literal["base64", "url", "multipart"] = "base64"
+    imageFormat: Literal["png", "webp", "jpeg"] = "png"
+    quality: int = Field(90, ge=1, le=100)
+    # Downsize images so their longest side is at most this many pixels
+    maxSize: Optional[int] = Field(None, ge=64)
+    # Inference profile: "preview" or "draft" for quick previews up to "final" for full quality
+    profile: str = DEFAULT_INFERENCE_PROFILE
 
-class GetScenesPayload(BaseModel):
+class GetScenesPayload(ImageOptions):
     story: Dict[str, Any]
     artStyle: str
+    seed: Optional[int] = None
+    seeds: Optional[Dict[str, int]] = None
+    # An earlier get_scenes result; scenes whose text is unchanged reuse its seed and cached image
+    previousScenes: Optional[Dict[str, Dict[str, Any]]] = None
+
+class RenderScenePayload(ImageOptions):
+    sceneKey: str
+    text: str
+    artStyle: str
+    seed: Optional[int] = None
+
+class UpscaleScenesPayload(ImageOptions):
+    # The scenes to keep from a get_scenes result, each with its "Text" and "Seed"
+    scenes: Dict[str, Dict[str, Any]]
+    artStyle: str
+    # Profile the scenes were previewed with
+    previewProfile: str = "preview"
+    # How far img2img may move away from the preview; 1 ignores it entirely
+    strength: float = Field(UPSCALE_STRENGTH, gt=0, le=1)
+
+@contextmanager
+def render_errors():
+    """Maps render worker errors to HTTP responses."""
+    try:
+        yield
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except WorkerUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Rendering timed out.")
+
 
 @app.get("/")
 async def root():
     return {"message": "API is up and running"}
 
-@app.post("/api/stories/generate")
-async def generate_story(payload: GenerateStoryPayload):
-    """Generates a story outline based on a prompt, genre, and tone."""
+@app.get("/healthz")
+async def healthz():
+    """Liveness check: the server answers requests. Fails only after a failed warm-up, which needs a restart."""
+    if warmup_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": warmup_error})
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness check: the models are loaded and warmed up, so renders start without delay."""
+    if warmup_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": warmup_error})
+    if not models_ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    if RENDER_MODE == "remote":
+        try:
+            await asyncio.to_thread(render_worker.status)
+        except WorkerUnavailableError as e:
+            return JSONResponse(status_code=503, content={"status": "model_server_unavailable", "error": str(e)})
+    return {"status": "ready"}
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Returns hit/miss counters for the rendered image cache and the crew output cache."""
+    with render_errors():
+        images = await asyncio.to_thread(render_worker.cache_stats) if render_worker is not None else {}
+    return {"images": images, "crews": crew_cache.stats()}
+
+@app.get("/api/executors/stats")
+async def executor_stats():
+    """Returns queue wait and run time totals for the LLM flow and post-processing pools."""
+    return execution.stats()
+
+@app.get("/api/artifacts/stats")
+async def artifact_stats():
+    """Returns the resolved model and LoRA files, rejected LoRAs, cold-start time and memory of the pipeline's process."""
+    if RENDER_MODE == "remote":
+        if render_worker is None:
+            raise HTTPException(status_code=503, detail="Not connected to the model server yet.")
+        with render_errors():
+            return (await asyncio.to_thread(render_worker.status))["artifacts"]
+    return artifact_report(artifact_store, cold_start_seconds)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Exposes per-stage latency histograms, queue depths and in-flight counts for Prometheus."""
+    # Queue gauges of a remote render worker ask the model server
+    body, content_type = await asyncio.to_thread(metrics.render_metrics)
+    return Response(content=body, media_type=content_type)
+
+async def run_story_generation(payload: GenerateStoryPayload):
     def run_story_flow():
+        from story_creator_flow.main import StoryFlow
+
         story_flow = StoryFlow()
         story_flow.kickoff(inputs={
             "user_story": payload.prompt,
             "user_genre": payload.genre,
             "user_tone": payload.tone,
-            "user_audience": "kids"
+            "user_audience": "kids",
+            "trace_id": current_trace_id() or "",
         })
         return story_flow
     
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as executor:
-        story_flow = await loop.run_in_executor(executor, run_story_flow)
+    story_flow = await execution.llm.run(run_story_flow)
     
     if not story_flow.state.story:
         raise HTTPException(status_code=500, detail="Story generation failed.")
+
+    if payload.prefetchScenes:
+        # get_scenes receives the story back as parsed JSON and runs the
+        # scene flow on str() of it, so prefetch with that exact text
+        # The prefetch outlives a /generate/stream request; keep its events out of that stream but its spans in the trace
+        with unsubscribed():
+            annotate(prefetch_started=scene_prefetcher.start(str(jsonable_encoder(story_flow.state.story))))
+        if payload.artStyle and models_ready.is_set():
+            render_worker.prewarm(payload.artStyle.lower())
         
     return story_flow.state.story
 
 
-@app.post("/api/stories/refine")
-async def refine_story(payload: RefineStoryPayload):
-    """Refines an existing story using Gemini 2.0 Flash Lite via CrewAI."""
+@app.post("/api/stories/generate")
+async def generate_story(payload: GenerateStoryPayload):
+    """Generates a story outline based on a prompt, genre, and tone."""
+    return await run_story_generation(payload)
+
+
+def stream_llm_progress(stream_format: str, work: Callable[[], Awaitable[Dict[str, Any]]]) -> StreamingResponse:
+    """Runs `work` while streaming the stage and token events it publishes, then a `done` event with its result."""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Queue()
+
+    def listener(event, data):
+        loop.call_soon_threadsafe(ready.put_nowait, (event, data))
+
+    with subscribe(listener):
+        # The task copies the current context, so flows it starts on the pool publish to this listener
+        task = asyncio.create_task(work())
+    # Events published before the work finished are already queued ahead of this marker
+    task.add_done_callback(lambda _: ready.put_nowait(None))
+
+    async def events():
+        try:
+            while True:
+                item = await ready.get()
+                if item is None:
+                    break
+                event, data = item
+                yield stream_event(stream_format, event, data)
+
+            if task.cancelled():
+                yield stream_event(stream_format, "error", {"detail": "Generation was cancelled."})
+            elif task.exception():
+                error = task.exception()
+                detail = error.detail if isinstance(error, HTTPException) else str(error)
+                yield stream_event(stream_format, "error", {"detail": detail})
+            else:
+                yield stream_event(stream_format, "done", jsonable_encoder(task.result()))
+        finally:
+            task.cancel()
+
+    return StreamingResponse(events(), media_type=STREAM_MEDIA_TYPES[stream_format])
+
+
+@app.post("/api/stories/generate/stream")
+async def stream_generate_story(payload: GenerateStoryPayload, format: str = "ndjson"):
+    """Streams stage progress and the story draft as it is written, ending with the full story."""
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Stream format '{format}' not supported.")
+
+    async def work():
+        return {"story": await run_story_generation(payload)}
+
+    return stream_llm_progress(format, work)
+
+
+def refine_llm(stream: bool):
+    from story_creator_flow.llm_backend import get_llm
+
+    return get_llm(REFINE_MODEL, stream=stream)
+
+
+def run_refine_llm(messages, stream: bool):
+    with stage("refine_llm"):
+        return refine_llm(stream).call(messages)
+
+
+def run_refine_sections(story: StoryDetails, instruction: str, sections: Optional[List[str]], stream: bool):
+    return refine_sections(refine_llm(stream), story, instruction, execution.llm_calls, sections, select_llm=refine_llm(False))
+
+
+async def run_section_refinement(payload: RefineStoryPayload, stream: bool = False) -> Dict[str, Any]:
+    if not any(section in payload.story for section in SECTIONS):
+        raise HTTPException(status_code=400, detail=f"Section refinement needs a story with the sections {', '.join(SECTIONS)}.")
+    unknown = [section for section in payload.sections or [] if section not in SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}.")
+
+    try:
+        return await execution.llm.run(
+            run_refine_sections,
+            StoryDetails.model_validate(payload.story),
+            payload.prompt,
+            payload.sections,
+            stream,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"LLM refinement failed: {str(e)}")
+
+
+async def run_refinement(payload: RefineStoryPayload, stream: bool = False) -> Dict[str, Any]:
+    if payload.mode == "sections":
+        return await run_section_refinement(payload, stream)
     try:
         prompt = f"Refine this story for kids: {payload.story}\nPrompt: {payload.prompt}"
-        refined_story = await llm.chat(
-            messages=[
+        refined_story = await execution.llm.run(
+            run_refine_llm,
+            [
                 {"role": "system", "content": "You are a helpful assistant that refines children's stories."},
                 {"role": "user", "content": prompt}
             ],
-            model="gemini-2.0-flash-lite"
+            stream,
         )
         return {"refined_story": refined_story}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM refinement failed: {str(e)}")
 
-@app.post("/api/stories/get_scenes")
-async def get_scenes(payload: GetScenesPayload):
-    """Generates 5 distinct scenes from a story outline and creates images for them."""
-    def run_scenes_flow():
-        scenes_flow = ScenesFlow()
-        scenes_flow.kickoff(inputs={"story": str(payload.story)})
-        return scenes_flow
-    
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as executor:
-        scenes_flow = await loop.run_in_executor(executor, run_scenes_flow)
-    
+
+@app.post("/api/stories/refine")
+async def refine_story(payload: RefineStoryPayload):
+    """Refines an existing story using Gemini 2.0 Flash Lite via CrewAI.
+
+    In "sections" mode only the affected story sections are regenerated, and the
+    response carries the merged story, the changed section names and a patch.
+    """
+    return await run_refinement(payload)
+
+
+@app.post("/api/stories/refine/stream")
+async def stream_refine_story(payload: RefineStoryPayload, format: str = "ndjson"):
+    """Streams the refined story's tokens as they arrive, ending with the full refinement."""
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Stream format '{format}' not supported.")
+    return stream_llm_progress(format, lambda: run_refinement(payload, stream=True))
+
+async def admit_render(art_style: str, profile: str = DEFAULT_INFERENCE_PROFILE) -> str:
+    """Validates the art style and inference profile and checks render capacity, returning the normalized style."""
+    if not models_ready.is_set():
+        detail = f"Image pipeline failed to load: {warmup_error}" if warmup_error else "Image pipeline is still loading."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "10"})
+    art_style = art_style.lower()
+    if art_style not in render_worker.registry:
+        raise HTTPException(status_code=400, detail=f"Art style '{art_style}' not supported.")
+    if profile not in INFERENCE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Inference profile '{profile}' not supported; use one of {', '.join(INFERENCE_PROFILES)}.")
+    with render_errors():
+        # Fail fast before spending an LLM round-trip on a job the worker would reject.
+        # A remote worker asks the model server, so keep that round trip off the event loop.
+        await asyncio.to_thread(render_worker.check_admission)
+    return art_style
+
+
+def run_scenes_flow(story_text: str) -> Dict[str, str]:
+    from story_creator_flow.main import ScenesFlow
+
+    scenes_flow = ScenesFlow()
+    scenes_flow.kickoff(inputs={"story": story_text, "trace_id": current_trace_id() or ""})
+
     if not scenes_flow.state.scenes:
         raise HTTPException(status_code=500, detail="Scene generation failed.")
 
-    scenes_dict = scenes_flow.state.scenes.dict()
+    return scenes_flow.state.scenes.dict()
 
-    art_style = payload.artStyle.lower()
-    lora_path = lora_adapters.get(art_style)
-    if not lora_path:
-        raise HTTPException(status_code=400, detail=f"Art style '{art_style}' not supported.")
-    
-    # Load the specific LoRA adapter for this request
-    pipe.load_lora_weights(lora_path)
+
+async def extract_scenes(payload: GetScenesPayload) -> Dict[str, str]:
+    """Returns the scene texts by key, reusing a prefetched extraction when the story is unchanged."""
+    story_text = str(payload.story)
+    prefetched = scene_prefetcher.take(story_text)
+    if prefetched is not None:
+        # The prefetch's spans belong to the generate request that started it
+        annotate(prefetched_scenes=True)
+        try:
+            return await asyncio.wrap_future(prefetched)
+        except Exception as e:
+            print(f"Prefetched scene extraction failed, running it again: {e}")
+
+    return await execution.llm.run(run_scenes_flow, story_text)
+
+
+def encode_scene(image, options: ImageOptions) -> Future:
+    """Starts post-processing a rendered image on the shared pool."""
+    return execution.cpu.submit(encode_and_store, image, options)
+
+
+def encode_and_store(image, options: ImageOptions) -> EncodedImage:
+    encoded = postprocess_image(
+        image,
+        options.imageFormat,
+        options.quality,
+        options.maxSize,
+        options.responseMode == "base64",
+    )
+    if options.responseMode != "base64":
+        # The image store may be on disk; write it here rather than on the event loop
+        image_store.put(encoded.data, encoded.media_type, encoded.sha256)
+    return encoded
+
+
+def format_scene(scene_prompt: str, encoded: Optional[EncodedImage], seed: int, options: ImageOptions) -> Dict[str, Any]:
+    if encoded is None:
+        return {"PIL": None, "Text": scene_prompt, "Seed": seed, "Profile": options.profile}
+
+    if options.responseMode == "base64":
+        return {"PIL": encoded.base64, "Text": scene_prompt, "Seed": seed, "Profile": options.profile}
+
+    # Stored under its content hash by encode_and_store
+    image_id = encoded.sha256
+    return {
+        "PIL": None,
+        "Text": scene_prompt,
+        "Seed": seed,
+        "Profile": options.profile,
+        "ImageId": image_id,
+        "ImageUrl": f"/api/images/{image_id}",
+    }
+
+
+async def render_and_encode(art_style: str, scenes: Dict[str, str], seeds: Dict[str, int], options: ImageOptions, **job_options):
+    """Renders scenes, encoding each image on the post-processing pool while the next one renders."""
+    encoded = {}
+
+    def on_image(key, image):
+        encoded[key] = encode_scene(image, options)
+
+    with render_errors():
+        await render_worker.render(art_style, scenes, seeds, on_image=on_image, profile=options.profile, **job_options)
+
+    return {key: await asyncio.wrap_future(encoded[key]) if key in encoded else None for key in scenes}
+
+
+async def scenes_response(formatted_scenes: Dict[str, Dict[str, Any]], options: ImageOptions):
+    """Returns the scenes as JSON, or as multipart/form-data with a JSON part followed by one part per image."""
+    with stage("response_serialization"):
+        if options.responseMode != "multipart":
+            return JSONResponse(content=formatted_scenes)
+        # Reads the images back from the image store
+        return await asyncio.to_thread(multipart_response, formatted_scenes, options)
+
+
+def multipart_response(formatted_scenes: Dict[str, Dict[str, Any]], options: ImageOptions):
+    boundary = uuid.uuid4().hex
+    extension = IMAGE_FORMATS[options.imageFormat][0].lower()
+    parts = [("scenes", "application/json", None, json.dumps(formatted_scenes).encode("utf-8"))]
+    for key, scene in formatted_scenes.items():
+        stored = image_store.get(scene["ImageId"]) if scene.get("ImageId") else None
+        if stored:
+            data, media_type = stored
+            parts.append((key, media_type, f"{key}.{extension}", data))
+
+    body = io.BytesIO()
+    for name, media_type, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body.write(f"--{boundary}\r\nContent-Disposition: {disposition}\r\nContent-Type: {media_type}\r\n\r\n".encode("utf-8"))
+        body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode("utf-8"))
+    return Response(content=body.getvalue(), media_type=f"multipart/form-data; boundary={boundary}")
+
+
+def plan_renders(payload: GetScenesPayload, scenes_dict: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, int]]:
+    """Returns the prompt and seed to render each scene with.
+
+    Scenes whose normalized text matches one in `previousScenes` are rendered
+    with that scene's exact text and seed, so they are served from the image
+    cache instead of the GPU. Changed scenes keep the seed their slot had.
+    Explicit per-scene `seeds` always win.
+    """
+    seeds = scene_seeds(payload.story, list(scenes_dict), payload.seed, payload.seeds)
+    prompts = dict(scenes_dict)
+    if not payload.previousScenes:
+        return prompts, seeds
+
+    explicit = payload.seeds or {}
+    matches = match_previous_scenes(scenes_dict, payload.previousScenes)
+    for key in scenes_dict:
+        if key in explicit:
+            continue
+        if key in matches:
+            prompts[key] = matches[key]["Text"]
+            seeds[key] = matches[key]["Seed"]
+        elif payload.seed is None and isinstance(payload.previousScenes.get(key, {}).get("Seed"), int):
+            seeds[key] = payload.previousScenes[key]["Seed"]
+    annotate(reused_scenes=len(matches))
+    return prompts, seeds
+
+
+async def run_scenes_generation(payload: GetScenesPayload, art_style: str):
+    scenes_dict = await extract_scenes(payload)
+    prompts, seeds = plan_renders(payload, scenes_dict)
+    encoded = await render_and_encode(art_style, prompts, seeds, payload)
 
     formatted_scenes = {}
+    for key, scene_prompt in scenes_dict.items():
+        formatted_scenes[key] = format_scene(scene_prompt, encoded[key], seeds[key], payload)
+
+    return formatted_scenes
+
+
+@app.post("/api/stories/get_scenes")
+async def get_scenes(payload: GetScenesPayload):
+    """Generates 5 distinct scenes from a story outline and creates images for them.
+
+    Each scene is rendered with a fixed seed: `seeds` overrides individual scenes,
+    the rest derive from `seed` (or a hash of the story). The seed used is returned
+    per scene as "Seed". Passing the previous result as `previousScenes` re-renders
+    only the scenes whose text changed.
+    """
+    art_style = await admit_render(payload.artStyle, payload.profile)
+    return await scenes_response(await run_scenes_generation(payload, art_style), payload)
+
+
+@app.post("/api/stories/render_scene")
+async def render_scene(payload: RenderScenePayload):
+    """Re-renders the image for a single scene from its existing text, without running the scene LLM flow.
+
+    Pass the "Seed" returned by get_scenes to reproduce an image, or a new seed to
+    get a different one; without a seed it is derived from the scene text.
+    """
+    if payload.sceneKey not in Scenes.model_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown scene '{payload.sceneKey}'.")
+    if not payload.text:
+        raise HTTPException(status_code=400, detail="Scene text must not be empty.")
+    art_style = await admit_render(payload.artStyle, payload.profile)
+
+    scenes = {payload.sceneKey: payload.text}
+    if payload.seed is not None:
+        seeds = {payload.sceneKey: payload.seed}
+    else:
+        seeds = scene_seeds(payload.text, [payload.sceneKey])
+    encoded = await render_and_encode(art_style, scenes, seeds, payload)
+
+    formatted_scene = format_scene(payload.text, encoded[payload.sceneKey], seeds[payload.sceneKey], payload)
+    return await scenes_response({payload.sceneKey: formatted_scene}, payload)
+
+
+@app.post("/api/stories/upscale_scenes")
+async def upscale_scenes(payload: UpscaleScenesPayload):
+    """Renders the kept scenes of a preview at full quality, starting from their preview images.
+
+    Pass the scenes to keep from a get_scenes call made with the "preview"
+    profile, each with the "Text" and "Seed" it returned. Every scene is refined
+    through img2img with the same prompt and seed, so the result keeps the
+    preview's composition; previews no longer in the cache are rendered again.
+    """
+    if not payload.scenes:
+        raise HTTPException(status_code=400, detail="No scenes to upscale.")
+    for key, scene in payload.scenes.items():
+        if key not in Scenes.model_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown scene '{key}'.")
+        if not isinstance(scene.get("Text"), str) or not scene["Text"] or not isinstance(scene.get("Seed"), int):
+            raise HTTPException(status_code=400, detail=f"Scene '{key}' needs the \"Text\" and \"Seed\" its preview was rendered with.")
+    if payload.previewProfile not in INFERENCE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Inference profile '{payload.previewProfile}' not supported; use one of {', '.join(INFERENCE_PROFILES)}.")
+    art_style = await admit_render(payload.artStyle, payload.profile)
+
+    scenes = {key: scene["Text"] for key, scene in payload.scenes.items()}
+    seeds = {key: scene["Seed"] for key, scene in payload.scenes.items()}
+    encoded = await render_and_encode(
+        art_style, scenes, seeds, payload, upscale_from=payload.previewProfile, strength=payload.strength
+    )
+
+    formatted_scenes = {key: format_scene(scenes[key], encoded[key], seeds[key], payload) for key in scenes}
+    return await scenes_response(formatted_scenes, payload)
+
+
+@app.get("/api/images/{image_id}")
+async def get_image(image_id: str):
+    """Serves a rendered image stored by a "url" or "multipart" mode response."""
+    stored = await asyncio.to_thread(image_store.get, image_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f"Image '{image_id}' not found.")
+    data, media_type = stored
+    # Image ids are content hashes, so the id doubles as a strong ETag
+    return Response(content=data, media_type=media_type, headers={"ETag": f'"{image_id}"'})
+
+
+def stream_event(stream_format: str, event: str, data: Dict[str, Any]) -> str:
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, **data}) + "\n"
+
+
+@app.post("/api/stories/get_scenes/stream")
+async def stream_scenes(payload: GetScenesPayload, format: str = "ndjson"):
+    """Streams each scene's text and image as soon as it is rendered, as NDJSON lines or server-sent events."""
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Stream format '{format}' not supported.")
+    if payload.responseMode == "multipart":
+        raise HTTPException(status_code=400, detail="Streaming supports the 'base64' and 'url' response modes.")
+    art_style = await admit_render(payload.artStyle, payload.profile)
+    scenes_dict = await extract_scenes(payload)
+    prompts, seeds = plan_renders(payload, scenes_dict)
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Queue()
+    encoded = {}
+
+    def on_image(key, image):
+        encoded[key] = encode_scene(image, payload)
+        encoded[key].add_done_callback(lambda _: loop.call_soon_threadsafe(ready.put_nowait, key))
+
+    with render_errors():
+        future = render_worker.submit(
+            art_style,
+            prompts,
+            seeds,
+            max_batch_size=STREAM_BATCH_SIZE,
+            on_image=on_image,
+            profile=payload.profile,
+        )
+    # Every on_image call happens before the render future completes
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(ready.put_nowait, None))
+
+    async def events():
+        try:
+            for key, scene_prompt in scenes_dict.items():
+                if not scene_prompt:
+                    yield stream_event(format, "scene", {"Scene": key, **format_scene(scene_prompt, None, seeds[key], payload)})
+
+            deadline = loop.time() + render_worker.job_timeout
+            rendered = False
+            sent = set()
+            while not (rendered and sent == set(encoded)):
+                try:
+                    key = await asyncio.wait_for(ready.get(), timeout=deadline - loop.time())
+                except asyncio.TimeoutError:
+                    yield stream_event(format, "error", {"detail": "Rendering timed out."})
+                    return
+                if key is None:
+                    rendered = True
+                    continue
+                sent.add(key)
+                scene = format_scene(scenes_dict[key], encoded[key].result(), seeds[key], payload)
+                yield stream_event(format, "scene", {"Scene": key, **scene})
+
+            if future.cancelled():
+                yield stream_event(format, "error", {"detail": "Rendering was cancelled."})
+            elif future.exception():
+                yield stream_event(format, "error", {"detail": str(future.exception())})
+            else:
+                yield stream_event(format, "done", {})
+        finally:
+            future.cancel()
+
+    return StreamingResponse(events(), media_type=STREAM_MEDIA_TYPES[format])
+
+
+async def run_job(job_id: str, work):
+    # The job store may write files; a finished result can be several megabytes
+    await asyncio.to_thread(job_store.update, job_id, status="running")
     try:
-        for key, scene_prompt in scenes_dict.items():
-            if not scene_prompt:
-                formatted_scenes[key] = {"PIL": None, "Text": scene_prompt}
-                continue
-
-            image = pipe(prompt=scene_prompt).images[0]
-            
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-            formatted_scenes[key] = {"PIL": img_str, "Text": scene_prompt}
-    finally:
-        # Unload the adapter in a finally block to ensure it's always unloaded
-        # This is the key difference and an improvement from the original code
-        pipe.unload_lora_weights()
-    
-    return formatted_scenes
\ No newline at end of file
+        result = await work
+    except HTTPException as e:
+        await asyncio.to_thread(job_store.update, job_id, status="failed", error=str(e.detail))
+    except Exception as e:
+        await asyncio.to_thread(job_store.update, job_id, status="failed", error=str(e))
+    else:
+        await asyncio.to_thread(job_store.update, job_id, status="succeeded", result=jsonable_encoder(result))
+
+
+async def start_job(kind: str, work) -> Dict[str, str]:
+    job = await asyncio.to_thread(job_store.create, kind)
+    task = asyncio.create_task(run_job(job.id, work))
+    # Keep a reference so the task is not garbage collected while it runs
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.post("/api/jobs/stories/generate", status_code=202)
+async def submit_generate_story(payload: GenerateStoryPayload):
+    """Starts story generation in the background and returns its job id."""
+    return await start_job("generate", run_story_generation(payload))
+
+
+@app.post("/api/jobs/stories/get_scenes", status_code=202)
+async def submit_get_scenes(payload: GetScenesPayload):
+    """Starts scene generation in the background and returns its job id."""
+    if payload.responseMode == "multipart":
+        raise HTTPException(status_code=400, detail="Background jobs support the 'base64' and 'url' response modes.")
+    art_style = await admit_render(payload.artStyle, payload.profile)
+    return await start_job("get_scenes", run_scenes_generation(payload, art_style))
+
+
+async def find_job(job_id: str) -> Job:
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Returns the status of a background job without its result."""
+    return (await find_job(job_id)).model_dump(exclude={"result"})
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Returns the result of a finished job; 409 while it is still running."""
+    job = await find_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' is {job.status}.")
+    return job.result
\ No newline at end of file
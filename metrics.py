@@ -0,0 +1,87 @@
+from typing import Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# From a millisecond-scale encode up to a multi-minute LLM flow
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "story_stage_seconds",
+    "Time spent in each pipeline stage: flow steps, diffusion, LoRA activation, encoding and serialization.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_ERRORS = Counter("story_stage_errors_total", "Stages that raised instead of finishing.", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response headers are sent, by route.",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.")
+RENDER_QUEUE_DEPTH = Gauge("render_queue_depth", "Render jobs waiting for the GPU.")
+RENDER_IN_FLIGHT = Gauge("render_jobs_in_flight", "Render jobs currently holding the pipeline.")
+POOL_QUEUED = Gauge("executor_queued_tasks", "Tasks waiting for a worker thread.", ["pool"])
+POOL_RUNNING = Gauge("executor_running_tasks", "Tasks running on a worker thread.", ["pool"])
+COLD_START_SECONDS = Gauge("cold_start_seconds", "Seconds from importing the app until the models were loaded and warmed up.")
+PROCESS_MEMORY = Gauge(
+    "process_memory_bytes",
+    "Memory of this worker; pss splits pages shared with other workers, such as memory-mapped weights, between them.",
+    ["kind"],
+)
+MEMORY_KINDS = ("rss", "pss", "shared", "private")
+
+
+def observe_span(span):
+    """Feeds a finished span into the request or stage histogram."""
+    if span.stage == "request":
+        REQUEST_SECONDS.labels(
+            method=span.attributes.get("method", ""),
+            route=span.attributes.get("route", ""),
+            status=str(span.attributes.get("status", "")),
+        ).observe(span.duration)
+        return
+    STAGE_SECONDS.labels(stage=span.stage).observe(span.duration)
+    if span.failed:
+        STAGE_ERRORS.labels(stage=span.stage).inc()
+
+
+def track_render_worker(worker):
+    RENDER_QUEUE_DEPTH.set_function(lambda: worker.queue_depth)
+    RENDER_IN_FLIGHT.set_function(lambda: worker.in_flight)
+
+
+def track_pools(execution):
+    for name, pool in execution.pools().items():
+        POOL_QUEUED.labels(pool=name).set_function(lambda pool=pool: pool.stats()["queued"])
+        POOL_RUNNING.labels(pool=name).set_function(lambda pool=pool: pool.stats()["running"])
+
+
+def process_memory() -> Dict[str, int]:
+    """Returns this process's resident, proportional, shared and private memory in bytes (Linux only)."""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                parts = value.split()
+                if len(parts) == 2 and parts[1] == "kB":
+                    fields[name] = int(parts[0]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def track_process_memory():
+    for kind in MEMORY_KINDS:
+        PROCESS_MEMORY.labels(kind=kind).set_function(lambda kind=kind: process_memory().get(kind, 0))
+
+
+def render_metrics():
+    """Returns the exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,391 @@
+"""Owns the diffusion pipeline and LoRA adapters on behalf of every API worker on the host.
+
+With RENDER_MODE=remote the API workers only run routes and LLM flows and send
+render jobs here over a Unix socket, so the pipeline is loaded once however
+many API workers there are:
+
+    python model_server.py
+    RENDER_MODE=remote uvicorn main:app --workers 4
+"""
+import asyncio
+import contextvars
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Dict, Optional
+sys.path.append(os.path.join(os.path.dirname(__file__), 'story-generator', 'story_creator_flow', 'src'))
+
+from artifact_store import LORA_FILES, SDXL_MODEL_ID, ArtifactStore
+from image_cache import ImageCache
+from lora_registry import LoraRegistry
+from inference_profiles import DEFAULT_INFERENCE_PROFILE
+from render_worker import RENDER_JOB_TIMEOUT, RENDER_QUEUE_DEPTH, QueueFullError, RenderWorker, WorkerUnavailableError
+from rendering import MAX_BATCH_SIZE, UPSCALE_STRENGTH, image_to_image_pipeline
+from story_creator_flow.instrumentation import JsonLinesExporter, add_observer, current_trace_id, stage, trace
+from stub_pipeline import StubPipeline
+import metrics
+
+STARTED_AT = time.perf_counter()
+
+# "stub" swaps SDXL for StubPipeline, so the API runs on CPU-only machines without model downloads
+DIFFUSION_BACKEND = os.environ.get("DIFFUSION_BACKEND", "sdxl")
+# Denoising steps of the warm-up inference run after loading; 0 skips it
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", "1"))
+WARMUP_IMAGE_SIZE = int(os.environ.get("WARMUP_IMAGE_SIZE", "512"))
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "/tmp/story-generator-model.sock")
+# Shared secret API workers must present; the socket is also only accessible to its owner
+MODEL_SERVER_AUTHKEY = os.environ.get("MODEL_SERVER_AUTHKEY", "").encode("utf-8") or None
+# Serve the model server's own Prometheus metrics on this port; empty disables it
+MODEL_SERVER_METRICS_PORT = os.environ.get("MODEL_SERVER_METRICS_PORT", "")
+# Seconds to wait for a status reply before treating the model server as unavailable
+MODEL_SERVER_STATUS_TIMEOUT = float(os.environ.get("MODEL_SERVER_STATUS_TIMEOUT", "5"))
+# Seconds a status reply is reused for the queue gauges, so a scrape costs at most one round trip
+MODEL_SERVER_STATUS_MAX_AGE = float(os.environ.get("MODEL_SERVER_STATUS_MAX_AGE", "2"))
+
+
+def load_pipeline(store: ArtifactStore):
+    """Loads the SDXL pipeline, or the stub, and returns it with its model id."""
+    if DIFFUSION_BACKEND == "stub":
+        print("Using the stub diffusion pipeline.")
+        return StubPipeline(), "stub"
+
+    import torch
+    from diffusers import StableDiffusionXLPipeline
+
+    model_path, local = store.resolve_model(SDXL_MODEL_ID)
+    print(f"Loading SDXL pipeline from {model_path}...")
+    pipe = StableDiffusionXLPipeline.from_pretrained(
+        model_path,
+        torch_dtype=torch.float16,
+        use_safetensors=True,
+        local_files_only=local,
+    ).to("cuda" if torch.cuda.is_available() else "cpu")
+    return pipe, SDXL_MODEL_ID
+
+
+def load_render_worker(store: ArtifactStore, cache: Optional[ImageCache]) -> RenderWorker:
+    """Loads the pipeline and the LoRAs, runs one tiny inference and starts a render worker on them."""
+    with stage("pipeline_load", backend=DIFFUSION_BACKEND):
+        pipe, model_id = load_pipeline(store)
+
+    with stage("lora_load"):
+        artifacts = store.validate_loras(LORA_FILES)
+        for style, problem in store.invalid.items():
+            print(f"Invalid LoRA for '{style}' style: {problem}")
+        if DIFFUSION_BACKEND == "stub":
+            lora_paths = {style: store.lora_path(filename) for style, filename in LORA_FILES.items()}
+        else:
+            lora_paths = {style: artifact.path for style, artifact in artifacts.items()}
+        registry = LoraRegistry(pipe)
+        for style, path in lora_paths.items():
+            registry.register(style, path)
+
+    if WARMUP_STEPS > 0:
+        # Compiles kernels and fills the allocator's pools, which otherwise slows down the first real render
+        with stage("warmup_inference", steps=WARMUP_STEPS):
+            pipe(
+                prompt="warm-up",
+                num_inference_steps=WARMUP_STEPS,
+                height=WARMUP_IMAGE_SIZE,
+                width=WARMUP_IMAGE_SIZE,
+            )
+
+    worker = RenderWorker(
+        registry,
+        cache=cache,
+        render_params={"model": model_id},
+        # The stub takes an init image in its regular call
+        image_to_image=(lambda pipe: pipe) if DIFFUSION_BACKEND == "stub" else image_to_image_pipeline,
+    )
+    worker.start()
+    return worker
+
+
+def artifact_report(store: ArtifactStore, cold_start_seconds: Optional[float]) -> Dict[str, Any]:
+    """Returns the resolved artifacts, cold-start time and memory of the process that owns the pipeline."""
+    return {**store.stats(), "cold_start_seconds": cold_start_seconds, "memory": metrics.process_memory()}
+
+
+def _portable(error: Exception) -> Exception:
+    # The API worker re-raises what it receives, so it must survive pickling
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(str(error))
+
+
+class ModelServer:
+    """Accepts render jobs from API workers on a Unix socket, one connection per request.
+
+    A render request streams back one message per finished scene, then a final
+    "done" or "error", so API workers can post-process and stream images while
+    the rest of the job is still rendering.
+    """
+
+    def __init__(self, worker: RenderWorker, store: ArtifactStore, cold_start_seconds: float):
+        self.worker = worker
+        self.store = store
+        self.cold_start_seconds = cold_start_seconds
+
+    def serve_forever(self, address: str = MODEL_SERVER_SOCKET, authkey: Optional[bytes] = MODEL_SERVER_AUTHKEY):
+        if os.path.exists(address):
+            os.unlink(address)
+        with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+            os.chmod(address, 0o600)
+            print(f"Model server listening on {address}.")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"Rejected model server connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name="model-server-conn", daemon=True).start()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.worker.running,
+            "styles": list(self.worker.registry.adapters),
+            "queue_depth": self.worker.queue_depth,
+            "in_flight": self.worker.in_flight,
+            "max_queue_depth": self.worker.max_queue_depth,
+            "job_timeout": self.worker.job_timeout,
+            "cache": self.worker.cache_stats(),
+            "artifacts": artifact_report(self.store, self.cold_start_seconds),
+        }
+
+    def _handle(self, conn: Connection):
+        with conn:
+            try:
+                command, *args = conn.recv()
+                if command == "status":
+                    conn.send(self.status())
+                elif command == "prewarm":
+                    self.worker.prewarm(*args)
+                elif command == "render":
+                    self._render(conn, *args)
+            except (EOFError, OSError):
+                # The API worker went away; its job, if any, finishes for the cache
+                pass
+
+    def _render(self, conn: Connection, job: Dict[str, Any], trace_id: Optional[str]):
+        lock = threading.Lock()
+
+        def on_image(key, image):
+            try:
+                with lock:
+                    conn.send(("image", key, image))
+            except OSError:
+                # The API worker went away; keep rendering so the images still reach the cache
+                pass
+
+        try:
+            # The job captures this context, so its spans join the API request's trace
+            with trace(trace_id):
+                future = self.worker.submit(on_image=on_image, **job)
+            future.result()
+        except CancelledError:
+            result = ("error", asyncio.TimeoutError("Render job expired in the model server queue."))
+        except Exception as e:
+            result = ("error", _portable(e))
+        else:
+            result = ("done",)
+        with lock:
+            conn.send(result)
+
+
+class RemoteRenderWorker:
+    """Stands in for RenderWorker in API workers, forwarding jobs to the model server.
+
+    Each job runs on its own connection and thread, so API workers can have as
+    many renders outstanding as the model server's queue admits. Admission is
+    checked against the server's live queue depth.
+
+    `status`, `check_admission` and `cache_stats` make blocking round trips to
+    the server; call them off the event loop. `submit` and `prewarm` return
+    right away and talk to the server on their own threads.
+    """
+
+    def __init__(
+        self,
+        address: str = MODEL_SERVER_SOCKET,
+        authkey: Optional[bytes] = MODEL_SERVER_AUTHKEY,
+        job_timeout: float = RENDER_JOB_TIMEOUT,
+    ):
+        self.address = address
+        self.authkey = authkey
+        self.job_timeout = job_timeout
+        self.max_queue_depth = RENDER_QUEUE_DEPTH
+        # Style names the server has adapters for; refreshed with every status call
+        self.registry = frozenset()
+        self._status: Optional[tuple] = None
+
+    def _connect(self) -> Connection:
+        try:
+            return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        except (OSError, EOFError) as e:
+            raise WorkerUnavailableError(f"Model server is not reachable at {self.address}: {e}")
+
+    def status(self, max_age: float = 0) -> Dict[str, Any]:
+        """Asks the model server for its status, or reuses a reply younger than `max_age` seconds."""
+        cached = self._status
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+        with self._connect() as conn:
+            try:
+                conn.send(("status",))
+                if not conn.poll(MODEL_SERVER_STATUS_TIMEOUT):
+                    raise WorkerUnavailableError("Model server did not answer in time.")
+                status = conn.recv()
+            except (OSError, EOFError) as e:
+                raise WorkerUnavailableError(f"Model server connection lost: {e}")
+        self.registry = frozenset(status["styles"])
+        self.max_queue_depth = status["max_queue_depth"]
+        self.job_timeout = status["job_timeout"]
+        self._status = (time.monotonic(), status)
+        return status
+
+    def wait_until_available(self, interval: float = 1.0) -> Dict[str, Any]:
+        """Blocks until the model server answers, which it does once its pipeline is loaded."""
+        waiting = False
+        while True:
+            try:
+                return self.status()
+            except WorkerUnavailableError:
+                if not waiting:
+                    print(f"Waiting for the model server at {self.address}...")
+                    waiting = True
+                time.sleep(interval)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._status_field("queue_depth")
+
+    @property
+    def in_flight(self) -> int:
+        return self._status_field("in_flight")
+
+    def _status_field(self, name: str) -> int:
+        try:
+            return self.status(max_age=MODEL_SERVER_STATUS_MAX_AGE)[name]
+        except WorkerUnavailableError:
+            return 0
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.status()["cache"]
+
+    def stop(self):
+        # Jobs belong to the model server; outstanding ones finish there and fill its cache
+        pass
+
+    def check_admission(self):
+        """Raises if a job submitted now would be rejected by the model server."""
+        status = self.status()
+        if not status["running"]:
+            raise WorkerUnavailableError("Render worker is not running.")
+        if status["queue_depth"] >= status["max_queue_depth"]:
+            raise QueueFullError(f"Render queue is full ({status['max_queue_depth']} jobs).")
+
+    def submit(
+        self,
+        style: str,
+        scenes: Dict[str, str],
+        seeds: Dict[str, int],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        on_image: Optional[Callable] = None,
+        profile: str = DEFAULT_INFERENCE_PROFILE,
+        upscale_from: Optional[str] = None,
+        strength: float = UPSCALE_STRENGTH,
+    ) -> Future:
+        """Sends a render to the model server; `on_image(key, image)` is called as scenes arrive."""
+        job = {
+            "style": style,
+            "scenes": scenes,
+            "seeds": seeds,
+            "max_batch_size": max_batch_size,
+            "profile": profile,
+            "upscale_from": upscale_from,
+            "strength": strength,
+        }
+        future = Future()
+        thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._receive, job, on_image, future),
+            name="model-client",
+            daemon=True,
+        )
+        thread.start()
+        return future
+
+    def _receive(self, job: Dict[str, Any], on_image: Optional[Callable], future: Future):
+        future.set_running_or_notify_cancel()
+        images = {key: None for key in job["scenes"]}
+        try:
+            conn = self._connect()
+        except WorkerUnavailableError as e:
+            future.set_exception(e)
+            return
+        with conn:
+            try:
+                conn.send(("render", job, current_trace_id()))
+                while True:
+                    message = conn.recv()
+                    if message[0] == "image":
+                        _, key, image = message
+                        images[key] = image
+                        if on_image:
+                            on_image(key, image)
+                    elif message[0] == "error":
+                        future.set_exception(message[1])
+                        return
+                    else:
+                        future.set_result(images)
+                        return
+            except (OSError, EOFError) as e:
+                future.set_exception(WorkerUnavailableError(f"Model server connection lost: {e}"))
+            except Exception as e:
+                future.set_exception(e)
+
+    def prewarm(self, style: str):
+        """Asks the model server to activate the adapter for `style` ahead of a request."""
+        threading.Thread(target=self._send_prewarm, args=(style,), name="model-client", daemon=True).start()
+
+    def _send_prewarm(self, style: str):
+        try:
+            with self._connect() as conn:
+                conn.send(("prewarm", style))
+        except (WorkerUnavailableError, OSError):
+            pass
+
+    async def render(self, style: str, scenes: Dict[str, str], seeds: Dict[str, int], **kwargs):
+        """Sends a render and waits for it; raises asyncio.TimeoutError after `job_timeout`."""
+        future = self.submit(style, scenes, seeds, **kwargs)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.job_timeout)
+
+
+def main():
+    add_observer(metrics.observe_span)
+    trace_log_path = os.environ.get("TRACE_LOG_PATH", "")
+    if trace_log_path:
+        add_observer(JsonLinesExporter(trace_log_path))
+    if MODEL_SERVER_METRICS_PORT:
+        from prometheus_client import start_http_server
+
+        start_http_server(int(MODEL_SERVER_METRICS_PORT))
+    metrics.track_process_memory()
+
+    store = ArtifactStore()
+    worker = load_render_worker(store, ImageCache(executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-cache")))
+    metrics.track_render_worker(worker)
+    cold_start_seconds = time.perf_counter() - STARTED_AT
+    metrics.COLD_START_SECONDS.set(cold_start_seconds)
+    print(f"Model server ready after {cold_start_seconds:.1f}s.")
+    ModelServer(worker, store, cold_start_seconds).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
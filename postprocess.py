@@ -0,0 +1,42 @@
+import base64
+import hashlib
+from dataclasses import dataclass
+from typing import Optional
+
+from PIL import Image
+
+from image_store import encode_image
+from story_creator_flow.instrumentation import stage
+
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    media_type: str
+    sha256: str
+    base64: Optional[str] = None
+
+
+def postprocess_image(
+    image: Image.Image,
+    image_format: str = "png",
+    quality: int = 90,
+    max_size: Optional[int] = None,
+    as_base64: bool = False,
+) -> EncodedImage:
+    """Optionally downsizes, then encodes and hashes a rendered image.
+
+    Runs on the post-processing thread pool; Pillow releases the GIL while
+    encoding, so this overlaps with diffusion without copying images into
+    another process.
+    """
+    with stage("image_encode", format=image_format):
+        if max_size:
+            image = image.copy()
+            image.thumbnail((max_size, max_size))
+
+        data, media_type = encode_image(image, image_format, quality)
+        encoded = EncodedImage(data=data, media_type=media_type, sha256=hashlib.sha256(data).hexdigest())
+        if as_base64:
+            encoded.base64 = base64.b64encode(data).decode("utf-8")
+    return encoded
@@ -0,0 +1,286 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from PIL import Image
+
+from image_cache import ImageCache, image_cache_key
+from inference_profiles import DEFAULT_INFERENCE_PROFILE, INFERENCE_PROFILES, ProfileSwitcher
+from story_creator_flow.instrumentation import annotate, record_span, stage
+from rendering import MAX_BATCH_SIZE, UPSCALE_STRENGTH, image_to_image_pipeline, render_scenes
+
+RENDER_QUEUE_DEPTH = int(os.environ.get("RENDER_QUEUE_DEPTH", "8"))
+RENDER_JOB_TIMEOUT = float(os.environ.get("RENDER_JOB_TIMEOUT", "300"))
+# How many jobs for the active style may run back to back while jobs for
+# other styles are waiting.
+MAX_CONSECUTIVE_SAME_STYLE = 4
+
+
+class QueueFullError(Exception):
+    """Raised when the render queue is at its configured depth."""
+
+
+class WorkerUnavailableError(Exception):
+    """Raised when the render worker is not running."""
+
+
+@dataclass
+class RenderJob:
+    style: str
+    scenes: Dict[str, str]
+    seeds: Dict[str, int]
+    deadline: float
+    max_batch_size: int = MAX_BATCH_SIZE
+    profile: str = DEFAULT_INFERENCE_PROFILE
+    # Profile of the previews to upscale through img2img; None renders from scratch
+    upscale_from: Optional[str] = None
+    strength: float = UPSCALE_STRENGTH
+    on_image: Optional[Callable] = None
+    future: Future = field(default_factory=Future)
+    submitted_at: float = field(default_factory=time.monotonic)
+    # The submitter's trace context, entered while the worker thread runs the job
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+class RenderWorker:
+    """Owns the pipeline on a single consumer thread fed by a bounded job queue.
+
+    Handlers submit jobs and await the result without blocking the event loop.
+    Submissions beyond `max_queue_depth` are rejected immediately, and jobs
+    whose deadline passes while queued are dropped without touching the GPU.
+    Queued jobs for the active LoRA style go first, up to `max_consecutive`
+    in a row, to keep adapter switches to a minimum.
+    Scenes found in `cache` are served without acquiring the pipeline at all;
+    `render_params` describes the pipeline settings that go into the cache key,
+    together with the settings of the job's inference profile.
+    `image_to_image` wraps the pipeline for upscale jobs.
+    """
+
+    def __init__(
+        self,
+        registry,
+        cache: Optional[ImageCache] = None,
+        render_params: Optional[Dict[str, Any]] = None,
+        max_queue_depth: int = RENDER_QUEUE_DEPTH,
+        job_timeout: float = RENDER_JOB_TIMEOUT,
+        image_to_image: Callable = image_to_image_pipeline,
+        max_consecutive: int = MAX_CONSECUTIVE_SAME_STYLE,
+    ):
+        self.registry = registry
+        self.cache = cache
+        self.render_params = render_params or {}
+        self.profiles = ProfileSwitcher(registry.pipe)
+        self.image_to_image = image_to_image
+        self.max_queue_depth = max_queue_depth
+        self.job_timeout = job_timeout
+        self.max_consecutive = max_consecutive
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._consecutive = 0
+        self.in_flight = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats() if self.cache else {}
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="render-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            pending = list(self._queue)
+            self._queue.clear()
+            self._condition.notify_all()
+        for job in pending:
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_exception(WorkerUnavailableError("Render worker stopped."))
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def check_admission(self):
+        """Raises if a job submitted now would be rejected."""
+        if not self._running:
+            raise WorkerUnavailableError("Render worker is not running.")
+        if len(self._queue) >= self.max_queue_depth:
+            raise QueueFullError(f"Render queue is full ({self.max_queue_depth} jobs).")
+
+    def submit(
+        self,
+        style: str,
+        scenes: Dict[str, str],
+        seeds: Dict[str, int],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        on_image: Optional[Callable] = None,
+        profile: str = DEFAULT_INFERENCE_PROFILE,
+        upscale_from: Optional[str] = None,
+        strength: float = UPSCALE_STRENGTH,
+    ) -> Future:
+        """Queues a render; `on_image(key, image)` is called from the worker thread as scenes finish.
+
+        With `upscale_from`, each scene's preview rendered with that profile is
+        refined into a `profile` image through img2img with the same prompt and seed.
+        """
+        with self._condition:
+            self.check_admission()
+            job = RenderJob(
+                style=style,
+                scenes=scenes,
+                seeds=seeds,
+                deadline=time.monotonic() + self.job_timeout,
+                max_batch_size=max_batch_size,
+                profile=profile,
+                upscale_from=upscale_from,
+                strength=strength,
+                on_image=on_image,
+            )
+            self._queue.append(job)
+            self._condition.notify()
+        return job.future
+
+    def prewarm(self, style: str):
+        """Activates the adapter for `style` ahead of a request, if the worker has nothing else queued."""
+        with self._condition:
+            if not self._running or self._queue or style not in self.registry:
+                return
+            self._queue.append(RenderJob(style=style, scenes={}, seeds={}, deadline=time.monotonic() + self.job_timeout))
+            self._condition.notify()
+
+    async def render(self, style: str, scenes: Dict[str, str], seeds: Dict[str, int], **kwargs):
+        """Queues a render and waits for it; raises asyncio.TimeoutError after `job_timeout`."""
+        future = self.submit(style, scenes, seeds, **kwargs)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.job_timeout)
+
+    def _next_job(self) -> RenderJob:
+        # Prefer jobs for the active adapter, unless it has already had its run.
+        if self._consecutive < self.max_consecutive:
+            for job in self._queue:
+                if job.style == self.registry.active_style:
+                    self._queue.remove(job)
+                    self._consecutive += 1
+                    return job
+        job = self._queue.popleft()
+        self._consecutive = self._consecutive + 1 if job.style == self.registry.active_style else 1
+        return job
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or not self._running)
+                if not self._running:
+                    return
+                job = self._next_job()
+
+            if time.monotonic() > job.deadline:
+                job.future.cancel()
+                continue
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            job.context.run(self._process, job)
+
+    def _process(self, job: RenderJob):
+        record_span("render_queue_wait", time.monotonic() - job.submitted_at)
+        self.in_flight = 1
+        try:
+            with stage("render_job", style=job.style, scenes=len(job.scenes), profile=job.profile):
+                images = self._render(job)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(images)
+        finally:
+            self.in_flight = 0
+
+    def _render(self, job: RenderJob):
+        if not job.scenes:
+            # A pre-warm job: switching to the adapter is all there is to do
+            with self.registry.use(job.style):
+                return {}
+
+        profile = INFERENCE_PROFILES[job.profile]
+        params = {**self.render_params, **profile.settings()}
+        if job.upscale_from is not None:
+            params.update(upscaled_from=INFERENCE_PROFILES[job.upscale_from].settings(), strength=job.strength)
+        images = {key: None for key in job.scenes}
+        cache_keys = {}
+        misses = {}
+        for key, scene_prompt in job.scenes.items():
+            if not scene_prompt:
+                continue
+            cache_keys[key] = image_cache_key(scene_prompt, job.style, job.seeds[key], params)
+            cached = self.cache.get(cache_keys[key]) if self.cache else None
+            if cached is None:
+                misses[key] = scene_prompt
+                continue
+            images[key] = cached
+            if job.on_image:
+                job.on_image(key, cached)
+
+        annotate(cache_hits=len(cache_keys) - len(misses))
+        if not misses:
+            return images
+
+        def on_rendered(key, image):
+            if self.cache:
+                self.cache.put(cache_keys[key], image)
+            if job.on_image:
+                job.on_image(key, image)
+
+        with self.registry.use(job.style) as pipe:
+            if job.upscale_from is not None:
+                images.update(self._upscale(pipe, job, misses, on_rendered))
+            else:
+                self.profiles.apply(profile)
+                images.update(render_scenes(pipe, misses, job.seeds, job.max_batch_size, on_rendered, profile.pipeline_kwargs()))
+        return images
+
+    def _upscale(self, pipe, job: RenderJob, scenes: Dict[str, str], on_rendered: Callable):
+        source = INFERENCE_PROFILES[job.upscale_from]
+        target = INFERENCE_PROFILES[job.profile]
+        source_params = {**self.render_params, **source.settings()}
+        source_keys = {key: image_cache_key(scene_prompt, job.style, job.seeds[key], source_params) for key, scene_prompt in scenes.items()}
+        previews = {key: self.cache.get(source_keys[key]) if self.cache else None for key in scenes}
+        missing = {key: scenes[key] for key, preview in previews.items() if preview is None}
+        annotate(previews_rerendered=len(missing))
+        if missing:
+            # Previews are deterministic, so one that left the cache is rendered again rather than failing the upscale
+            def on_preview(key, image):
+                if self.cache:
+                    self.cache.put(source_keys[key], image)
+
+            self.profiles.apply(source)
+            previews.update(render_scenes(pipe, missing, job.seeds, job.max_batch_size, on_preview, source.pipeline_kwargs()))
+
+        self.profiles.apply(target)
+        init_images = {key: preview.resize((target.width, target.height), Image.LANCZOS) for key, preview in previews.items()}
+        return render_scenes(
+            self.image_to_image(pipe),
+            scenes,
+            job.seeds,
+            job.max_batch_size,
+            on_rendered,
+            target.image_to_image_kwargs(job.strength),
+            init_images,
+        )
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from PIL import Image
+
+from story_creator_flow.instrumentation import stage
+
+# torch is imported where it is used so the API starts without it; the pipeline loader imports it first
+if TYPE_CHECKING:
+    import torch
+
+# Upper bound on how many scene prompts go through the pipeline in one call.
+MAX_BATCH_SIZE = int(os.environ.get("RENDER_MAX_BATCH_SIZE", "5"))
+# Streaming responses trade total throughput for time-to-first-image.
+STREAM_BATCH_SIZE = int(os.environ.get("RENDER_STREAM_BATCH_SIZE", "1"))
+# How far an upscale may move away from its preview: 0 keeps it as is, 1 ignores it.
+UPSCALE_STRENGTH = float(os.environ.get("UPSCALE_STRENGTH", "0.5"))
+
+
+def derive_seed(*parts: Any) -> int:
+    """Derives a stable 31-bit seed from arbitrary JSON-serializable parts."""
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") & 0x7FFFFFFF
+
+
+def scene_seeds(
+    story: Any,
+    scene_keys: List[str],
+    seed: Optional[int] = None,
+    seeds: Optional[Dict[str, int]] = None,
+) -> Dict[str, int]:
+    """Picks the seed for every scene.
+
+    Explicit per-scene `seeds` win; the others are derived from `seed` and the
+    scene key, falling back to a hash of the story when no seed is given.
+    """
+    base_seed = seed if seed is not None else derive_seed(story)
+    seeds = seeds or {}
+    return {key: seeds[key] if key in seeds else derive_seed(base_seed, key) for key in scene_keys}
+
+
+def scene_text_hash(text: str) -> str:
+    """Hashes scene text with case and whitespace normalized away."""
+    return hashlib.sha256(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+
+
+def match_previous_scenes(scenes: Dict[str, str], previous: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Maps every scene whose normalized text equals a previously rendered scene to that scene.
+
+    `previous` is an earlier get_scenes result; scenes are matched by text, not
+    key, so a scene that moved to another slot is still recognized.
+    """
+    rendered = {}
+    for scene in previous.values():
+        if isinstance(scene.get("Text"), str) and scene["Text"] and isinstance(scene.get("Seed"), int):
+            rendered.setdefault(scene_text_hash(scene["Text"]), scene)
+
+    matches = {}
+    for key, scene_prompt in scenes.items():
+        if scene_prompt and scene_text_hash(scene_prompt) in rendered:
+            matches[key] = rendered[scene_text_hash(scene_prompt)]
+    return matches
+
+
+def _generators(pipe, seeds: List[int]) -> List["torch.Generator"]:
+    import torch
+
+    return [torch.Generator(device=pipe.device).manual_seed(seed) for seed in seeds]
+
+
+def _is_out_of_memory(error: Exception) -> bool:
+    import torch
+
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    return "out of memory" in str(error).lower()
+
+
+def _free_device_memory():
+    import torch
+
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def render_prompts(
+    pipe,
+    prompts: List[str],
+    seeds: List[int],
+    max_batch_size: int = MAX_BATCH_SIZE,
+    on_image: Optional[Callable[[int, Image.Image], None]] = None,
+    pipeline_kwargs: Optional[Dict[str, Any]] = None,
+    init_images: Optional[List[Image.Image]] = None,
+) -> List[Image.Image]:
+    """Renders prompts in batches, halving the batch size whenever the device runs out of memory.
+
+    Each prompt gets its own generator seeded from `seeds`, so an image does not
+    depend on which batch it landed in. `on_image` is called with each prompt's
+    index and image as soon as its batch finishes. `pipeline_kwargs`, such as
+    step count and resolution, are passed to every pipeline call, and
+    `init_images` to an img2img pipeline alongside their prompts.
+    """
+    images = []
+    batch_size = max(1, max_batch_size)
+    start = 0
+    while start < len(prompts):
+        batch = prompts[start:start + batch_size]
+        generators = _generators(pipe, seeds[start:start + batch_size])
+        kwargs = dict(pipeline_kwargs or {})
+        if init_images is not None:
+            kwargs["image"] = init_images[start:start + batch_size]
+        try:
+            with stage("diffusion", batch_size=len(batch)):
+                batch_images = pipe(prompt=batch, generator=generators, **kwargs).images
+        except RuntimeError as e:
+            if batch_size == 1 or not _is_out_of_memory(e):
+                raise
+            _free_device_memory()
+            batch_size = max(1, batch_size // 2)
+            print(f"Out of memory rendering {len(batch)} prompts, retrying with batch size {batch_size}.")
+            continue
+        if on_image:
+            for offset, image in enumerate(batch_images):
+                on_image(start + offset, image)
+        images.extend(batch_images)
+        start += len(batch)
+    return images
+
+
+def render_scenes(
+    pipe,
+    scenes: Dict[str, str],
+    seeds: Dict[str, int],
+    max_batch_size: int = MAX_BATCH_SIZE,
+    on_image: Optional[Callable[[str, Image.Image], None]] = None,
+    pipeline_kwargs: Optional[Dict[str, Any]] = None,
+    init_images: Optional[Dict[str, Image.Image]] = None,
+) -> Dict[str, Optional[Image.Image]]:
+    """Renders every non-empty scene prompt and maps the images back to their scene keys."""
+    keys = [key for key, scene_prompt in scenes.items() if scene_prompt]
+    scene_callback = (lambda index, image: on_image(keys[index], image)) if on_image else None
+    images = render_prompts(
+        pipe,
+        [scenes[key] for key in keys],
+        [seeds[key] for key in keys],
+        max_batch_size,
+        scene_callback,
+        pipeline_kwargs,
+        [init_images[key] for key in keys] if init_images is not None else None,
+    )
+
+    rendered = {key: None for key in scenes}
+    rendered.update(zip(keys, images))
+    return rendered
+
+
+def image_to_image_pipeline(pipe):
+    """Returns an SDXL img2img pipeline sharing `pipe`'s weights, LoRA adapters and current scheduler."""
+    from diffusers import StableDiffusionXLImg2ImgPipeline
+
+    return StableDiffusionXLImg2ImgPipeline.from_pipe(pipe)
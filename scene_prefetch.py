@@ -0,0 +1,68 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, Optional
+
+SCENE_PREFETCH_MAX_ENTRIES = int(os.environ.get("SCENE_PREFETCH_MAX_ENTRIES", "32"))
+SCENE_PREFETCH_TTL = float(os.environ.get("SCENE_PREFETCH_TTL", "1800"))
+
+
+def story_key(story_text: str) -> str:
+    return hashlib.sha256(story_text.encode("utf-8")).hexdigest()
+
+
+class ScenePrefetcher:
+    """Starts scene extraction for a freshly generated story before the client asks for it.
+
+    `extract` turns the story text into scene texts; it runs on `executor` and
+    its future is kept, keyed by the story text, until it is taken, evicted as
+    least recently started, or older than `ttl`. While `max_pending`
+    extractions are still running, new ones are skipped rather than queued:
+    under load a queued prefetch would finish after the client asked anyway.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        extract: Callable[[str], Dict[str, str]],
+        max_entries: int = SCENE_PREFETCH_MAX_ENTRIES,
+        ttl: float = SCENE_PREFETCH_TTL,
+        max_pending: int = 1,
+    ):
+        self.executor = executor
+        self.extract = extract
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._futures: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, story_text: str) -> bool:
+        """Starts extracting scenes for `story_text` unless it already is or the prefetcher is busy; returns whether it did."""
+        key = story_key(story_text)
+        with self._lock:
+            if key in self._futures:
+                return True
+            if sum(not future.done() for future, _ in self._futures.values()) >= self.max_pending:
+                return False
+            future = self.executor.submit(self.extract, story_text)
+            self._futures[key] = (future, time.monotonic() + self.ttl)
+            while len(self._futures) > self.max_entries:
+                _, (evicted, _) = self._futures.popitem(last=False)
+                evicted.cancel()
+        return True
+
+    def take(self, story_text: str) -> Optional[Future]:
+        """Returns the prefetched (possibly still running) extraction for this exact story text."""
+        with self._lock:
+            entry = self._futures.pop(story_key(story_text), None)
+        if entry is None:
+            return None
+        future, expires = entry
+        if time.monotonic() > expires:
+            future.cancel()
+            return None
+        return future
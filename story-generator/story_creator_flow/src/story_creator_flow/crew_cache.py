@@ -0,0 +1,201 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from story_creator_flow.instrumentation import annotate
+
+CREW_CACHE_MEMORY_ITEMS = int(os.environ.get("CREW_CACHE_MEMORY_ITEMS", "128"))
+# Path of the SQLite file backing the on-disk tier; empty keeps the cache in memory only
+CREW_CACHE_DB = os.environ.get("CREW_CACHE_DB", "")
+CREW_CACHE_TTL = float(os.environ.get("CREW_CACHE_TTL", "86400"))
+
+
+def _parse_list(value: str):
+    return {item.strip() for item in value.split(",") if item.strip()}
+
+
+def _parse_ttls(value: str) -> Dict[str, float]:
+    ttls = {}
+    for item in _parse_list(value):
+        name, _, ttl = item.partition("=")
+        ttls[name.strip()] = float(ttl)
+    return ttls
+
+
+def _describe(value: Any):
+    # Once a crew is built its task configs reference Agent objects, whose ids
+    # are random; describe agents by what shapes their output instead.
+    if hasattr(value, "role"):
+        llm = getattr(value, "llm", None)
+        return {
+            "role": value.role,
+            "goal": getattr(value, "goal", None),
+            "backstory": getattr(value, "backstory", None),
+            "llm": getattr(llm, "model", llm if isinstance(llm, str) else None),
+        }
+    return type(value).__name__
+
+
+def _family(name: str) -> str:
+    # "head_crew.set_genre" is one step of head_crew and follows its settings
+    return name.split(".", 1)[0]
+
+
+def crew_cache_key(name: str, crew_base: Any, inputs: Dict[str, Any]) -> str:
+    """Hashes the crew name, its agent and task configuration, and the kickoff inputs."""
+    material = json.dumps(
+        {
+            "crew": name,
+            "agents": getattr(crew_base, "agents_config", None),
+            "tasks": getattr(crew_base, "tasks_config", None),
+            "inputs": inputs,
+        },
+        sort_keys=True,
+        default=_describe,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CrewCache:
+    """Caches crew kickoff outputs in a memory LRU with an optional SQLite tier.
+
+    Crews listed in `disabled` always call the LLM. Entries expire after the
+    crew's entry in `ttls`, falling back to `ttl`. A step name such as
+    `head_crew.set_tone` can be configured on its own or through its crew.
+    `executor` runs `kickoff_async`; the app sets it to a shared pool at
+    startup, and without one the running event loop's default executor is used.
+    """
+
+    def __init__(
+        self,
+        memory_items: int = CREW_CACHE_MEMORY_ITEMS,
+        db_path: str = CREW_CACHE_DB,
+        ttl: float = CREW_CACHE_TTL,
+        ttls: Optional[Dict[str, float]] = None,
+        disabled: Optional[set] = None,
+    ):
+        self.memory_items = memory_items
+        self.db_path = db_path
+        self.ttl = ttl
+        self.ttls = ttls if ttls is not None else _parse_ttls(os.environ.get("CREW_CACHE_TTLS", ""))
+        self.disabled = disabled if disabled is not None else _parse_list(os.environ.get("CREW_CACHE_DISABLED", ""))
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.executor: Optional[Executor] = None
+        if self.db_path:
+            with self._connect() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS crew_outputs "
+                    "(key TEXT PRIMARY KEY, crew TEXT, expires REAL, output BLOB)"
+                )
+
+    def kickoff(self, name: str, crew_base: Any, inputs: Dict[str, Any]):
+        """Returns the cached output for these inputs, or builds the crew and kicks it off."""
+        if name in self.disabled or _family(name) in self.disabled:
+            return self._kickoff(name, crew_base, inputs)
+
+        key = crew_cache_key(name, crew_base, inputs)
+        output = self.get(key)
+        if output is not None:
+            print(f"Using cached output for {name}")
+            annotate(crew=name, cached=True)
+            return output
+
+        output = self._kickoff(name, crew_base, inputs)
+        self.put(key, name, output)
+        return output
+
+    async def kickoff_async(self, name: str, crew_base: Any, inputs: Dict[str, Any]):
+        """Runs `kickoff` on `executor`, in a copy of the caller's context, so async flow steps can run crews side by side."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, self.kickoff, name, crew_base, inputs)
+
+    def _kickoff(self, name: str, crew_base: Any, inputs: Dict[str, Any]):
+        output = crew_base.crew().kickoff(inputs=inputs)
+        usage = getattr(output, "token_usage", None)
+        annotate(
+            crew=name,
+            cached=False,
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+            total_tokens=getattr(usage, "total_tokens", None),
+        )
+        return output
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        output = self._read_db(key, now)
+        with self._lock:
+            if output is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return output
+
+    def put(self, key: str, name: str, output):
+        expires = time.time() + self.ttls.get(name, self.ttls.get(_family(name), self.ttl))
+        with self._lock:
+            self._remember(key, expires, output)
+        if self.db_path:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO crew_outputs (key, crew, expires, output) VALUES (?, ?, ?, ?)",
+                    (key, name, expires, pickle.dumps(output)),
+                )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_items": len(self._memory)}
+
+    def _remember(self, key: str, expires: float, output):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = (expires, output)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _read_db(self, key: str, now: float):
+        if not self.db_path:
+            return None
+        with self._connect() as db:
+            db.execute("DELETE FROM crew_outputs WHERE expires <= ?", (now,))
+            row = db.execute("SELECT expires, output FROM crew_outputs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        expires, blob = row
+        output = pickle.loads(blob)
+        with self._lock:
+            self._remember(key, expires, output)
+        return output
+
+
+crew_cache = CrewCache()
@@ -3,6 +3,8 @@ from crewai.project import CrewBase, agent, crew, task
 from crewai.agents.agent_builder.base_agent import BaseAgent
 from typing import List
 
+from story_creator_flow.llm_backend import get_llm
+
 # If you want to run a snippet of code before or after the crew starts,
 # you can use the @before_kickoff and @after_kickoff decorators
 # https://docs.crewai.com/concepts/crews#example-crew-class-with-decorators
@@ -10,11 +12,18 @@ from typing import List
 
 @CrewBase
 class HeadCrew:
-    """Head Crew"""
+    """Head Crew
+
+    Each kickoff runs a single task, `step`, so the flow can run the genre and
+    tone guides side by side and pass both to character creation.
+    """
 
     agents: List[BaseAgent]
     tasks: List[Task]
 
+    def __init__(self, step: str = "create_character"):
+        self.step = step
+
     # agents_config = "config/agents.yaml"
     # tasks_config = "config/tasks.yaml"
 
@@ -22,6 +31,7 @@ class HeadCrew:
     def genre_setter(self) -> Agent:
         return Agent(
             config=self.agents_config["genre_setter"],
+            llm=get_llm(),
             verbose=True
         )
 
@@ -29,12 +39,14 @@ class HeadCrew:
     def tone_setter(self) -> Agent:
         return Agent(
             config=self.agents_config["tone_setter"],
+            llm=get_llm(),
         )
 
     @agent
     def character_creator(self) -> Agent:
         return Agent(
-            config=self.agents_config["character_creator"]
+            config=self.agents_config["character_creator"],
+            llm=get_llm(),
         )
 
     @task
@@ -57,14 +69,11 @@ class HeadCrew:
 
     @crew
     def crew(self) -> Crew:
-        """Creates the Research Crew"""
+        """Creates the crew for this step's task"""
+        step_task = getattr(self, self.step)()
         return Crew(
-            agents=[self.genre_setter(), self.tone_setter(), self.character_creator()],  
-            tasks=[
-                self.set_genre(),
-                self.set_tone(),
-                self.create_character(),
-            ], 
+            agents=[step_task.agent],
+            tasks=[step_task],
             process=Process.sequential,
             verbose=True,
         )
@@ -2,13 +2,9 @@ from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 from crewai.agents.agent_builder.base_agent import BaseAgent
 from typing import List
-from pydantic import BaseModel
-class Scenes(BaseModel):
-    scene_1: str = ""
-    scene_2: str = ""
-    scene_3: str = ""
-    scene_4: str = ""
-    scene_5: str = ""
+
+from story_creator_flow.llm_backend import get_llm
+from story_creator_flow.models import Scenes
 
 @CrewBase
 class SceneCreatorCrew:
@@ -24,6 +20,7 @@ class SceneCreatorCrew:
     def scene_creator(self) -> Agent:
         return Agent(
             config=self.agents_config["scene_creator"],
+            llm=get_llm(),
         )
 
     @task
@@ -2,7 +2,9 @@ from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 from crewai.agents.agent_builder.base_agent import BaseAgent
 from typing import List
-from pydantic import BaseModel
+
+from story_creator_flow.llm_backend import get_llm
+from story_creator_flow.models import StoryDetails
 
 # If you want to run a snippet of code before or after the crew starts,
 # you can use the @before_kickoff and @after_kickoff decorators
@@ -23,12 +25,14 @@ class StoryOutlineCrew:
     def story_outline_creator(self) -> Agent:
         return Agent(
             config=self.agents_config["story_outline_creator"],
+            llm=get_llm(stream=True),
         )
 
     @agent
     def story_detail_filler(self) -> Agent:
         return Agent(
             config=self.agents_config["story_detail_filler"],
+            llm=get_llm(stream=True),
         )
 
     @task
@@ -41,6 +45,7 @@ class StoryOutlineCrew:
     def fill_story_details(self) -> Task:
         return Task(
             config=self.tasks_config["fill_story_details"],
+            output_pydantic=StoryDetails,
             markdown=False,
         )
 
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+
+@dataclass
+class Span:
+    """One timed stage of a request; spans of the same request share a trace id."""
+
+    trace_id: Optional[str]
+    span_id: str
+    parent_id: Optional[str]
+    stage: str
+    start: float
+    duration: float = 0.0
+    failed: bool = False
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+# Called with every finished span; metrics and trace exporters are observers
+SpanObserver = Callable[[Span], None]
+
+_observers: List[SpanObserver] = []
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def add_observer(observer: SpanObserver):
+    """Registers a span sink; the flow package itself has no metrics or tracing backend."""
+    _observers.append(observer)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id: Optional[str]):
+    """Makes `trace_id` the trace of every span started in the enclosed block."""
+    token = _trace_id.set(trace_id)
+    try:
+        yield
+    finally:
+        _trace_id.reset(token)
+
+
+def annotate(**attributes):
+    """Adds attributes, such as token counts, to the innermost open span."""
+    span = _span.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def _new_span(name: str, attributes: Dict[str, Any]) -> Span:
+    parent = _span.get()
+    return Span(
+        trace_id=_trace_id.get(),
+        span_id=uuid.uuid4().hex[:16],
+        # A parent from another trace (e.g. a prefetch started by an earlier request) is not ours
+        parent_id=parent.span_id if parent is not None and parent.trace_id == _trace_id.get() else None,
+        stage=name,
+        start=time.time(),
+        attributes=attributes,
+    )
+
+
+def _emit(span: Span):
+    for observer in _observers:
+        try:
+            observer(span)
+        except Exception as e:
+            print(f"Span observer failed: {e}")
+
+
+@contextmanager
+def stage(name: str, trace_id: Optional[str] = None, **attributes):
+    """Times the enclosed block as a span and reports it to every registered observer.
+
+    `trace_id` re-enters a trace carried in flow state when the context
+    variables did not make it across a thread boundary.
+    """
+    trace_token = _trace_id.set(trace_id) if trace_id and trace_id != _trace_id.get() else None
+    span = _new_span(name, attributes)
+    span_token = _span.set(span)
+    started_at = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.failed = True
+        raise
+    finally:
+        span.duration = time.perf_counter() - started_at
+        _span.reset(span_token)
+        if trace_token is not None:
+            _trace_id.reset(trace_token)
+        _emit(span)
+
+
+def record_span(name: str, duration: float, **attributes):
+    """Reports a stage that has already finished, such as time spent waiting in a queue."""
+    span = _new_span(name, attributes)
+    span.start -= duration
+    span.duration = duration
+    _emit(span)
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def __call__(self, span: Span):
+        line = json.dumps(asdict(span), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import time
+from typing import Any, Optional
+
+from crewai import LLM
+from crewai.events import LLMStreamChunkEvent, TaskCompletedEvent, TaskStartedEvent, crewai_event_bus
+from crewai.llms.base_llm import BaseLLM
+from crewai.utilities.llm_utils import create_llm
+
+from story_creator_flow.streaming import publish
+
+# "fake" swaps every agent's model for FakeLLM; anything else uses crewAI's default model selection
+STORY_LLM_BACKEND = os.environ.get("STORY_LLM_BACKEND", "")
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.5"))
+
+
+class FakeLLM(BaseLLM):
+    """Offline stand-in for a chat model, for load tests and CPU-only development.
+
+    Sleeps for `latency` seconds, then answers with deterministic text derived
+    from the prompt. Tasks with an `output_pydantic` model get JSON that
+    validates against it, so flows such as ScenesFlow produce real `Scenes`.
+    With `stream`, the latency is spread over word-sized chunks published on
+    crewAI's event bus, like a streaming provider.
+    """
+
+    def __init__(self, latency: float = FAKE_LLM_LATENCY, stream: bool = False):
+        super().__init__(model="fake")
+        self.latency = latency
+        self.stream = stream
+
+    def call(
+        self,
+        messages,
+        tools=None,
+        callbacks=None,
+        available_functions=None,
+        from_task=None,
+        from_agent=None,
+    ) -> str:
+        if isinstance(messages, str):
+            prompt = messages
+        else:
+            prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        answer = self.answer(prompt, from_task)
+        if from_task is not None:
+            # Agents parse ReAct-style output and stop at the final answer
+            answer = f"Thought: I now can give a great answer\nFinal Answer: {answer}"
+
+        if not self.stream:
+            time.sleep(self.latency)
+            return answer
+        chunks = answer.split(" ")
+        for index, chunk in enumerate(chunks):
+            time.sleep(self.latency / len(chunks))
+            crewai_event_bus.emit(
+                self,
+                event=LLMStreamChunkEvent(
+                    chunk=chunk if index == 0 else " " + chunk,
+                    from_task=from_task,
+                    from_agent=from_agent,
+                ),
+            )
+        return answer
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+    def answer(self, prompt: str, task: Any = None) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        output_model = getattr(task, "output_pydantic", None)
+        if output_model is None:
+            return f"Placeholder answer {digest}: a short, plain response to the request."
+
+        fields = {
+            name: f"Placeholder {name.replace('_', ' ')} {digest}: a robot and a fox walk through a sunny forest."
+            for name in output_model.model_fields
+        }
+        return output_model.model_validate(fields).model_dump_json()
+
+
+def get_llm(model: Optional[str] = None, stream: bool = False) -> Optional[BaseLLM]:
+    """Returns the LLM to use, or None to let crewAI pick its configured default.
+
+    The fake backend replaces every model. `stream` makes the LLM publish its
+    output chunk by chunk for the streaming endpoints.
+    """
+    if STORY_LLM_BACKEND == "fake":
+        return FakeLLM(stream=stream)
+    if model is None and not stream:
+        return None
+    llm = LLM(model=model) if model else create_llm(None)
+    llm.stream = stream
+    return llm
+
+
+def _task_name(task: Any) -> Optional[str]:
+    return getattr(task, "name", None) or getattr(task, "description", None)
+
+
+# crewAI's event bus is process-wide; these forward its events to the subscriber of the emitting context
+@crewai_event_bus.on(LLMStreamChunkEvent)
+def _forward_chunk(source, event: LLMStreamChunkEvent):
+    if event.tool_call is None and event.chunk:
+        publish("token", text=event.chunk, task=event.task_name)
+
+
+@crewai_event_bus.on(TaskStartedEvent)
+def _forward_task_started(source, event: TaskStartedEvent):
+    publish("stage", stage=_task_name(event.task), status="started")
+
+
+@crewai_event_bus.on(TaskCompletedEvent)
+def _forward_task_completed(source, event: TaskCompletedEvent):
+    publish("stage", stage=_task_name(event.task), status="finished")
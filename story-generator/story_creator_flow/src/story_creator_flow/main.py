@@ -1,61 +1,95 @@
 #!/usr/bin/env python
+from contextlib import contextmanager
 from random import randint
 
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
-from crewai.flow import Flow, listen, start
+from crewai.flow import Flow, and_, listen, start
 
 from story_creator_flow.crews.head_crew.head_crew import HeadCrew
 from story_creator_flow.crews.story_outline_crew.story_outline_crew import StoryOutlineCrew
 from story_creator_flow.crews.scene_creator_crew.scene_creator_crew import SceneCreatorCrew
+from story_creator_flow.crew_cache import crew_cache
+from story_creator_flow.instrumentation import stage
+from story_creator_flow.models import Scenes, StoryDetails
+from story_creator_flow.streaming import publish
+
+@contextmanager
+def flow_step(name: str, trace_id: str):
+    """Records a flow step as a stage span and announces it to stream subscribers, even when its crew output is cached."""
+    publish("stage", stage=name, status="started")
+    with stage(name, trace_id=trace_id):
+        yield
+    publish("stage", stage=name, status="finished")
+
 
 class StoryFlowState(BaseModel):
+    genre_guide: str = ""
+    tone_guide: str = ""
     characters: str = ""
-    story: str = ""
+    story: Optional[StoryDetails] = None
     user_story: str = ""
     user_genre: str = "" 
     user_tone: str = ""
     user_audience: str = ""
-
-class Scenes(BaseModel):
-    scene_1: str = ""
-    scene_2: str = ""
-    scene_3: str = ""
-    scene_4: str = ""
-    scene_5: str = ""
+    trace_id: str = ""
 
 class ScenesFlowState(BaseModel):
     scenes: Scenes = Scenes()  # Provide a default value
     story: str = ""
+    trace_id: str = ""
     
 
 class StoryFlow(Flow[StoryFlowState]):
+    # The genre and tone guides are independent, so both start together on
+    # their own threads and character creation joins on them. A failing guide
+    # fails the kickoff.
     @start()
+    async def run_genre_guide(self):
+        print("Running HeadCrew genre guide")
+        with flow_step("run_genre_guide", self.state.trace_id):
+            result = await crew_cache.kickoff_async("head_crew.set_genre", HeadCrew("set_genre"), self.head_inputs())
+        self.state.genre_guide = result.raw
+
+    @start()
+    async def run_tone_guide(self):
+        print("Running HeadCrew tone guide")
+        with flow_step("run_tone_guide", self.state.trace_id):
+            result = await crew_cache.kickoff_async("head_crew.set_tone", HeadCrew("set_tone"), self.head_inputs())
+        self.state.tone_guide = result.raw
+
+    @listen(and_(run_genre_guide, run_tone_guide))
     def run_head_crew(self):
         print("Running HeadCrew")
-        result = (
-            HeadCrew()
-            .crew()
-            .kickoff(inputs={"story": self.state.user_story,
-                             "genre":self.state.user_genre, "tone": self.state.user_tone,
-                             "audience": self.state.user_audience})
-        )
+        with flow_step("run_head_crew", self.state.trace_id):
+            result = crew_cache.kickoff(
+                "head_crew.create_character",
+                HeadCrew("create_character"),
+                inputs={**self.head_inputs(),
+                        "genre_guide": self.state.genre_guide, "tone_guide": self.state.tone_guide},
+            )
         self.state.characters = result.raw
 
+    def head_inputs(self):
+        return {"story": self.state.user_story,
+                "genre":self.state.user_genre, "tone": self.state.user_tone,
+                "audience": self.state.user_audience}
+
     @listen(run_head_crew)
     def run_story_outline_crew(self):
         print("Running StoryOutlineCrew")
-        result = (
-            StoryOutlineCrew()
-            .crew()
-            .kickoff(inputs={
-                "characters": self.state.characters,
-                "audience": self.state.user_audience,
-                "story_tone": self.state.user_story,
-                "story_genre":self.state.user_genre,
-            })
-        )
+        with flow_step("run_story_outline_crew", self.state.trace_id):
+            result = crew_cache.kickoff(
+                "story_outline_crew",
+                StoryOutlineCrew(),
+                inputs={
+                    "characters": self.state.characters,
+                    "audience": self.state.user_audience,
+                    "story_tone": self.state.user_story,
+                    "story_genre":self.state.user_genre,
+                },
+            )
         self.state.story = result.pydantic
         print("Story Details:")
         print(self.state.story.introduction_setting)
@@ -67,13 +101,14 @@ class ScenesFlow(Flow[ScenesFlowState]):
     @start()
     def run_scene_creator_crew(self):
         print("Running SceneCreatorCrew")
-        result = (
-            SceneCreatorCrew()
-            .crew()
-            .kickoff(inputs={
-                "story": self.state.story,
-            })
-        )
+        with flow_step("run_scene_creator_crew", self.state.trace_id):
+            result = crew_cache.kickoff(
+                "scene_creator_crew",
+                SceneCreatorCrew(),
+                inputs={
+                    "story": self.state.story,
+                },
+            )
         self.state.scenes = result.pydantic
 
         # Print all scenes
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+
+
+class StoryDetails(BaseModel):
+    introduction_setting: str = ""
+    conflict_rising_action: str = ""
+    climax: str = ""
+    resolution: str = ""
+
+
+class Scenes(BaseModel):
+    scene_1: str = ""
+    scene_2: str = ""
+    scene_3: str = ""
+    scene_4: str = ""
+    scene_5: str = ""
@@ -0,0 +1,121 @@
+import contextvars
+import re
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional
+
+from story_creator_flow.instrumentation import annotate, stage
+from story_creator_flow.models import StoryDetails
+from story_creator_flow.streaming import publish, tagged
+
+SECTIONS = list(StoryDetails.model_fields)
+SECTION_LABELS = {
+    "introduction_setting": "Introduction/Setting",
+    "conflict_rising_action": "Conflict/Rising Action",
+    "climax": "Climax",
+    "resolution": "Resolution",
+}
+# Section names that cannot mean anything else in an instruction, so no LLM call is needed to
+# find the section. Everyday words such as "end", "start" or "setting" often describe the whole
+# story ("keep the ending, but..."), so instructions using them go to the LLM.
+SECTION_KEYWORDS = {
+    "introduction_setting": ("introduction_setting", "introduction"),
+    "conflict_rising_action": ("conflict_rising_action", "rising action"),
+    "climax": ("climax",),
+    "resolution": ("resolution",),
+}
+SYSTEM_PROMPT = "You are a helpful assistant that refines children's stories."
+
+
+def _messages(prompt: str) -> List[Dict[str, str]]:
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+
+def _sections_in(text: str, names: Dict[str, Any]) -> List[str]:
+    text = text.lower()
+    return [
+        section for section in SECTIONS
+        if any(re.search(rf"\b{re.escape(name)}\b", text) for name in names[section])
+    ]
+
+
+def select_sections(llm, story: StoryDetails, instruction: str) -> List[str]:
+    """Returns the sections an instruction touches.
+
+    Instructions that name a section are matched by keyword; otherwise the LLM
+    picks from the section texts. If it names none, every section is affected.
+    """
+    sections = _sections_in(instruction, SECTION_KEYWORDS)
+    if sections:
+        annotate(selected_by="keyword")
+        return sections
+
+    with stage("refine_select"):
+        story_text = "\n\n".join(f"{section}: {getattr(story, section)}" for section in SECTIONS)
+        answer = llm.call(_messages(
+            f"A children's story is split into these sections:\n\n{story_text}\n\n"
+            f"Instruction: {instruction}\n\n"
+            f"Which sections must change to follow the instruction? Reply only with their names "
+            f"from {', '.join(SECTIONS)}, separated by commas."
+        ))
+    sections = _sections_in(str(answer), {section: (section,) for section in SECTIONS})
+    annotate(selected_by="llm" if sections else "fallback")
+    return sections or SECTIONS
+
+
+def rewrite_section(llm, story: StoryDetails, section: str, instruction: str) -> str:
+    """Rewrites one section, showing the LLM only its neighbours for continuity."""
+    index = SECTIONS.index(section)
+    context = []
+    if index > 0:
+        context.append(f"Previous section ({SECTION_LABELS[SECTIONS[index - 1]]}): {getattr(story, SECTIONS[index - 1])}")
+    if index < len(SECTIONS) - 1:
+        context.append(f"Next section ({SECTION_LABELS[SECTIONS[index + 1]]}): {getattr(story, SECTIONS[index + 1])}")
+
+    # Rewrites run side by side; tag their stream events so clients can tell the sections apart
+    with tagged(section=section), stage("refine_section", section=section):
+        publish("stage", stage="refine_section", status="started")
+        answer = llm.call(_messages(
+            f"Rewrite the {SECTION_LABELS[section]} section of a children's story to follow the instruction. "
+            f"Keep everything the instruction does not ask to change and stay consistent with the surrounding sections.\n\n"
+            f"Instruction: {instruction}\n\n"
+            + "\n\n".join(context)
+            + f"\n\nSection to rewrite: {getattr(story, section)}\n\n"
+            f"Reply with the rewritten section text only."
+        ))
+        publish("stage", stage="refine_section", status="finished")
+    return str(answer).strip()
+
+
+def refine_sections(
+    llm,
+    story: StoryDetails,
+    instruction: str,
+    executor: Executor,
+    sections: Optional[List[str]] = None,
+    select_llm=None,
+) -> Dict[str, Any]:
+    """Regenerates only the sections the instruction touches and returns the patched story.
+
+    Rewrites run side by side on `executor`, which must not be the pool the
+    caller itself runs on. Sections are picked with `select_llm` (default
+    `llm`); pass a non-streaming model so the answer is not streamed as story
+    text. The result holds the merged `refined_story`, the
+    `changed_sections` and a JSON Patch (RFC 6902) style list of `replace`
+    operations, one per section whose text actually changed.
+    """
+    sections = sections or select_sections(select_llm or llm, story, instruction)
+    # Rewrites are independent LLM calls; run them in the caller's trace and stream context
+    futures = {
+        section: executor.submit(contextvars.copy_context().run, rewrite_section, llm, story, section, instruction)
+        for section in sections
+    }
+    rewritten = {section: future.result() for section, future in futures.items()}
+
+    patch = [
+        {"op": "replace", "path": f"/{section}", "value": text}
+        for section, text in rewritten.items()
+        if text and text != getattr(story, section)
+    ]
+    changed = [operation["path"][1:] for operation in patch]
+    refined = story.model_copy(update={section: rewritten[section] for section in changed})
+    return {"refined_story": refined.model_dump(), "changed_sections": changed, "patch": patch}
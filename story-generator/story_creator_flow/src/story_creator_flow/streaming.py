@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+# Called with (event, data) for every progress event of the current request
+StreamListener = Callable[[str, Dict[str, Any]], None]
+
+_listener: ContextVar[Optional[StreamListener]] = ContextVar("stream_listener", default=None)
+# Fields added to every event published in the current context
+_tags: ContextVar[Dict[str, Any]] = ContextVar("stream_tags", default={})
+
+
+@contextmanager
+def subscribe(listener: StreamListener):
+    """Sends progress events raised in the enclosed block, and in contexts copied from it, to `listener`.
+
+    crewAI's event bus is process-wide and calls handlers on the emitting
+    thread, so events are routed by context: only flows started under this
+    subscription reach the listener.
+    """
+    token = _listener.set(listener)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+@contextmanager
+def unsubscribed():
+    """Stops events raised in the enclosed block, and in contexts copied from it, from reaching the current listener.
+
+    For work that outlives the streaming request, such as a prefetch it starts.
+    """
+    token = _listener.set(None)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+@contextmanager
+def tagged(**tags):
+    """Adds `tags` to every event published in the enclosed block, e.g. to tell apart parallel LLM calls."""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def publish(event: str, **data):
+    listener = _listener.get()
+    if listener is not None:
+        listener(event, {**_tags.get(), **data})
+
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import time
+from types import SimpleNamespace
+from typing import List, Optional, Union
+
+from PIL import Image, ImageDraw
+
+# Seconds a stub "denoising" call takes per image at 50 steps and 1024x1024
+STUB_DIFFUSION_LATENCY = float(os.environ.get("STUB_DIFFUSION_LATENCY", "0.5"))
+STUB_IMAGE_SIZE = int(os.environ.get("STUB_IMAGE_SIZE", "256"))
+
+
+class StubScheduler:
+    pass
+
+
+class StubPipeline:
+    """Stands in for the SDXL pipeline on CPU-only machines and in load tests.
+
+    Mirrors the parts of the diffusers API the app uses. Each call sleeps for
+    `latency` per image, scaled by step count and pixel count like real
+    denoising, and returns flat images whose colour is derived from the prompt
+    and generator seed, so cache and seed behaviour stay observable.
+    """
+
+    def __init__(self, latency: float = STUB_DIFFUSION_LATENCY, size: int = STUB_IMAGE_SIZE):
+        self.latency = latency
+        self.size = size
+        self.device = "cpu"
+        self.scheduler = StubScheduler()
+        self.adapters: List[str] = []
+
+    def to(self, device):
+        return self
+
+    def load_lora_weights(self, path: str, adapter_name: Optional[str] = None):
+        pass
+
+    def set_adapters(self, adapter_names: List[str]):
+        self.adapters = list(adapter_names)
+
+    def enable_attention_slicing(self):
+        pass
+
+    def disable_attention_slicing(self):
+        pass
+
+    def enable_vae_tiling(self):
+        pass
+
+    def disable_vae_tiling(self):
+        pass
+
+    def __call__(
+        self,
+        prompt: Union[str, List[str]],
+        generator=None,
+        num_inference_steps: int = 50,
+        width: int = 1024,
+        height: int = 1024,
+        image: Optional[List[Image.Image]] = None,
+        strength: float = 1.0,
+        **kwargs,
+    ):
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        if generator is None:
+            generators = [None] * len(prompts)
+        else:
+            generators = generator if isinstance(generator, list) else [generator] * len(prompts)
+
+        if image is not None:
+            # img2img runs `steps * strength` steps at the size of its input images
+            num_inference_steps = int(num_inference_steps * strength)
+            width, height = image[0].size
+        time.sleep(self.latency * len(prompts) * (num_inference_steps / 50) * (width * height) / (1024 * 1024))
+        images = [self._image(text, gen.initial_seed() if gen is not None else 0) for text, gen in zip(prompts, generators)]
+        return SimpleNamespace(images=images)
+
+    def _image(self, prompt: str, seed: int) -> Image.Image:
+        digest = hashlib.sha256(f"{self.adapters}:{seed}:{prompt}".encode("utf-8")).digest()
+        image = Image.new("RGB", (self.size, self.size), tuple(digest[:3]))
+        ImageDraw.Draw(image).text((8, 8), prompt[:40], fill=(255, 255, 255))
+        return image